@@ -0,0 +1,99 @@
+import math
+import os
+import threading
+
+from embedding_cache import normalize_query
+from lru import LRUCache
+
+# Cache คำตอบของ /ask-codebase ผูกกับเวอร์ชันของ Corpus ใน Session (Ingest ใหม่ = เวอร์ชันใหม่ = Cache เก่าใช้ไม่ได้)
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", "3600"))
+# Cosine similarity ขั้นต่ำของคำถามที่ถือว่า "ถามเรื่องเดียวกัน" (0 = ใช้แค่ Exact Match)
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", "0"))
+# จำนวนคำถามสูงสุดต่อ Session ที่เก็บ Vector ไว้เทียบ Similarity
+ANSWER_CACHE_SIMILAR_PER_SESSION = 256
+
+
+def _command(question: str) -> str:
+    # คำสั่ง Persona (/refactor, /test, ...) ให้คำตอบคนละแบบ ต้องไม่ปนกัน
+    return question.split(" ", 1)[0] if question.startswith("/") else ""
+
+
+def _public(entry):
+    # Vector ที่เก็บไว้เทียบ Similarity ไม่ส่งออกไปกับคำตอบ
+    return {"answer": entry["answer"], "sources": entry["sources"]} if entry is not None else None
+
+
+def _unit(vector):
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class AnswerCache:
+    """Exact Match ด้วย LRU+TTL และ (ถ้าเปิด) ค้นคำถามที่คล้ายกันด้วย Embedding ภายใน Session/เวอร์ชันเดียวกัน"""
+
+    def __init__(self, maxsize: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL,
+                 similarity: float = ANSWER_CACHE_SIMILARITY):
+        self.entries = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.similarity = similarity
+        self.similar_hits = 0
+        # (session_id, version, command) -> [key] ของคำถามที่มี Vector (Vector อยู่ใน entry ของ self.entries
+        # จึงหมดอายุ / ถูกไล่ออกไปพร้อมคำตอบ) ตัว Bucket เองก็มี LRU+TTL ไม่ค้างตลอดไป
+        self._buckets = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(session_id, version, question):
+        return (session_id, version, normalize_query(question))
+
+    def get_exact(self, session_id: str, version, question: str):
+        if version is None:
+            return None
+        return _public(self.entries.get(self._key(session_id, version, question)))
+
+    def get_similar(self, session_id: str, version, question: str, vector):
+        """หาคำถามที่เคยถามแล้วซึ่ง Cosine >= similarity (คืน entry หรือ None)"""
+        if version is None or self.similarity <= 0 or vector is None:
+            return None
+        query = _unit(vector)
+        bucket_key = (session_id, version, _command(question))
+        with self._lock:
+            keys = self._buckets.peek(bucket_key, ())
+            candidates = [(key, self.entries.peek(key)) for key in keys]
+            live = [key for key, entry in candidates if entry is not None]
+            if len(live) != len(keys):
+                # คำตอบที่หมดอายุ / ถูกไล่ออกไปแล้ว ตัดออกจาก Bucket ด้วย
+                self._buckets.put(bucket_key, live) if live else self._buckets.pop(bucket_key)
+        best, best_score = None, self.similarity
+        for key, entry in candidates:
+            if entry is None:
+                continue
+            score = sum(a * b for a, b in zip(query, entry["vector"]))
+            if score >= best_score:
+                best, best_score = key, score
+        if best is None:
+            return None
+        entry = self.entries.get(best)
+        if entry is not None:
+            self.similar_hits += 1
+        return _public(entry)
+
+    def put(self, session_id: str, version, question: str, answer: str, sources, vector=None):
+        if version is None:
+            return
+        key = self._key(session_id, version, question)
+        if self.similarity <= 0 or vector is None:
+            self.entries.put(key, {"answer": answer, "sources": sources})
+            return
+        self.entries.put(key, {"answer": answer, "sources": sources, "vector": _unit(vector)})
+        bucket_key = (session_id, version, _command(question))
+        with self._lock:
+            bucket = [k for k in self._buckets.peek(bucket_key, ()) if k != key]
+            bucket.append(key)
+            self._buckets.put(bucket_key, bucket[-ANSWER_CACHE_SIMILAR_PER_SESSION:])
+
+    def stats(self):
+        stats = self.entries.stats()
+        stats["similar_hits"] = self.similar_hits
+        stats["similarity_threshold"] = self.similarity
+        return stats
@@ -0,0 +1,68 @@
+"""Benchmark: Throughput (MB/s) ของขั้นตอนตัด Chunk บน Repo จริง
+
+รัน: python bench_chunking.py <path ของ Repo> [จำนวนรอบ]
+เทียบ: Splitter ใหม่ทุกไฟล์ + create_documents (แบบเดิม), ขั้นตอน Split ทั้งหมดใน ingest_repo
+(Parse ครั้งเดียว -> chunk_file + Symbol Index) และเฉพาะการตัด Chunk (Parse ไว้ก่อนแล้ว ไม่นับเวลา ast)
+"""
+import os
+import sys
+import time
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+import chunking
+import symbol_index
+
+EXTENSIONS = ('.py', '.js', '.jsx', '.ts', '.tsx', '.md', '.txt', '.html', '.css', '.java', '.cs', '.go', '.php')
+
+
+def load_files(root: str):
+    files = []
+    for directory, dirs, filenames in os.walk(root):
+        dirs[:] = [d for d in dirs if d not in ('.git', 'node_modules')]
+        for name in filenames:
+            if name.endswith(EXTENSIONS):
+                path = os.path.join(directory, name)
+                with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                    files.append((os.path.relpath(path, root), f.read()))
+    return files
+
+
+def legacy(path: str, text: str):
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, separators=["\n\n", "\n", " ", ""])
+    return [chunk.page_content for chunk in splitter.create_documents([text])]
+
+
+def chunk_and_index(path: str, text: str):
+    symbols = symbol_index.extract_symbols(path, text)
+    symbol_index.SymbolIndex().add_file(path, text, symbols)
+    return chunking.chunk_file(path, text, symbols)
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    files = load_files(sys.argv[1])
+    size_mb = sum(len(text.encode('utf-8')) for _, text in files) / 1e6
+    print(f"{len(files)} files, {size_mb:.1f} MB, best of {rounds} rounds")
+    print(f"{'mode':<28}{'chunks':>10}{'seconds':>10}{'MB/s':>10}")
+    parsed = {path: symbol_index.extract_symbols(path, text) for path, text in files}
+
+    def split_only(path: str, text: str):
+        return chunking.chunk_file(path, text, parsed[path])
+
+    for label, fn in (("legacy splitter per file", legacy),
+                      ("parse + chunk + symbols", chunk_and_index),
+                      ("chunk only (pre-parsed)", split_only)):
+        best = None
+        for _ in range(rounds):
+            started = time.perf_counter()
+            chunks = sum(len(fn(path, text)) for path, text in files)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{label:<28}{chunks:>10}{best:>10.2f}{size_mb / best:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Benchmark: recall@k เทียบกับ Memory ของ Local Index แต่ละโหมด (float32 / float16 / int8 / int8 + re-rank)
+
+RAM นับทุก Array ที่อยู่ใน Memory จริง: "ingest" = ระหว่าง Upsert (ก่อน flush), "query" = หลัง flush (Matrix เปิดแบบ mmap)
+
+รัน: python bench_quantization.py [จำนวน vector] [จำนวนคำถาม]
+ใช้ข้อมูลสังเคราะห์แบบเป็นกลุ่มๆ (คล้าย Embedding ของโค้ดที่ Chunk ในไฟล์เดียวกันอยู่ใกล้กัน)
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import vector_store
+from vector_store import SessionIndex
+
+DIM = vector_store.DIMENSION
+K = 5
+
+
+def synthetic_embeddings(n: int, queries: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, n // 50), DIM)).astype(np.float32)
+    data = centers[rng.integers(0, len(centers), n)] + 0.6 * rng.standard_normal((n, DIM)).astype(np.float32)
+    picks = rng.integers(0, n, queries)
+    questions = data[picks] + 0.6 * rng.standard_normal((queries, DIM)).astype(np.float32)
+    return data, questions
+
+
+def build(path, data, dtype, quantization):
+    index = SessionIndex(path, dtype=dtype, quantization=quantization)
+    for start in range(0, len(data), 1000):
+        index.upsert([
+            {"id": str(i), "values": data[i], "metadata": {}} for i in range(start, min(start + 1000, len(data)))
+        ])
+    ingest_memory = index.memory_bytes()
+    index.flush()
+    return index, ingest_memory
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    data, questions = synthetic_embeddings(n, queries)
+
+    normalized = vector_store._normalize(data)
+    truth = [set(vector_store.top_k_rows(normalized @ vector_store._normalize(q), K)) for q in questions]
+
+    modes = [
+        ("float32", "float32", "none", None),
+        ("float16", "float16", "none", None),
+        ("int8 (no re-rank)", "float32", "int8", 1),
+        (f"int8 + re-rank x{vector_store.LOCAL_RERANK_FACTOR}", "float32", "int8", vector_store.LOCAL_RERANK_FACTOR),
+    ]
+    print(f"{n} vectors x {DIM} dims, {queries} queries, recall@{K}")
+    print(f"{'mode':<24}{'ingest MB':>10}{'query MB':>10}{'bytes/vec':>12}{'recall':>10}{'ms/query':>10}")
+    # Index ของทุกโหมดอยู่ใน Temp dir เดียว ลบทิ้งตอนจบ และคืนค่า Re-rank เดิมให้ Module
+    rerank_factor = vector_store.LOCAL_RERANK_FACTOR
+    with tempfile.TemporaryDirectory(prefix="bench_index_") as tmp_dir:
+        try:
+            for number, (label, dtype, quantization, rerank) in enumerate(modes):
+                index, ingest_memory = build(os.path.join(tmp_dir, str(number)), data, dtype, quantization)
+                if rerank is not None:
+                    vector_store.LOCAL_RERANK_FACTOR = rerank
+                memory = index.memory_bytes()
+                index.query(questions[0], K)  # warm up (สร้าง int8 codes)
+                started = time.perf_counter()
+                hits = 0
+                for q, expected in zip(questions, truth):
+                    hits += len(expected & {row for row, _ in index.query(q, K)})
+                elapsed = (time.perf_counter() - started) * 1000 / queries
+                print(f"{label:<24}{ingest_memory / 1e6:>10.1f}{memory / 1e6:>10.1f}{memory / n:>12.0f}{hits / (K * queries):>10.3f}{elapsed:>10.2f}")
+        finally:
+            vector_store.LOCAL_RERANK_FACTOR = rerank_factor
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import os
+import sqlite3
+
+import storage
+
+# เนื้อหา Chunk ของแต่ละ Session เก็บบน Disk (SQLite) แทนการถือไว้ใน BM25 Index ทั้งก้อน
+# Memory ตอน Ingest / ตอบคำถามจึงไม่โตตามขนาด Repo: อ่านเฉพาะ Chunk ที่ถูกค้นเจอ
+CHUNK_STORE_DIR = os.environ.get("CHUNK_STORE_DIR", "./ingest_state/chunks")
+COMMIT_EVERY = 1000
+
+
+def _path(session_id: str) -> str:
+    return os.path.join(CHUNK_STORE_DIR, f"{storage.safe_id(session_id)}.sqlite3")
+
+
+class ChunkStore:
+    """ข้อความ + ไฟล์ของทุก Chunk ใน Session เดียว (id -> (source, text)) ใช้จาก Thread เดียวต่อ Instance"""
+
+    def __init__(self, session_id: str):
+        os.makedirs(CHUNK_STORE_DIR, exist_ok=True)
+        self._conn = sqlite3.connect(_path(session_id), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, source TEXT NOT NULL, text TEXT NOT NULL)"
+        )
+        # โค้ดของ Definition ใน Symbol Index (Index ถือแค่ตำแหน่ง อ่านโค้ดจากตรงนี้ตอนตอบคำถาม)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS definitions (source TEXT NOT NULL, start INTEGER NOT NULL, code TEXT NOT NULL, "
+            "PRIMARY KEY (source, start))"
+        )
+        self._pending = 0
+
+    def put(self, doc_id: str, source: str, text: str):
+        self._conn.execute("INSERT OR REPLACE INTO chunks (id, source, text) VALUES (?, ?, ?)", (doc_id, source, text))
+        self._pending += 1
+        if self._pending >= COMMIT_EVERY:
+            self.commit()
+
+    def get_many(self, ids):
+        """{id: (source, text)} ของ id ที่มีอยู่"""
+        return _select(self._conn, ids)
+
+    def delete(self, ids):
+        ids = list(ids)
+        for start in range(0, len(ids), 500):
+            part = ids[start:start + 500]
+            self._conn.execute(f"DELETE FROM chunks WHERE id IN ({','.join('?' * len(part))})", part)
+        self.commit()
+
+    def put_definitions(self, source: str, codes):
+        """แทนที่โค้ด Definition ทั้งหมดของไฟล์ด้วย codes = [(บรรทัดเริ่ม, code)]"""
+        self._conn.execute("DELETE FROM definitions WHERE source = ?", (source,))
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO definitions (source, start, code) VALUES (?, ?, ?)",
+            [(source, start, code) for start, code in codes],
+        )
+        self._pending += len(codes) + 1
+        if self._pending >= COMMIT_EVERY:
+            self.commit()
+
+    def delete_definitions(self, sources):
+        self._conn.executemany("DELETE FROM definitions WHERE source = ?", [(source,) for source in sources])
+        self.commit()
+
+    def commit(self):
+        self._conn.commit()
+        self._pending = 0
+
+    def close(self):
+        self.commit()
+        self._conn.close()
+
+
+def _select(conn, ids):
+    ids = list(ids)
+    found = {}
+    for start in range(0, len(ids), 500):
+        part = ids[start:start + 500]
+        rows = conn.execute(
+            f"SELECT id, source, text FROM chunks WHERE id IN ({','.join('?' * len(part))})", part
+        ).fetchall()
+        found.update((doc_id, (source, text)) for doc_id, source, text in rows)
+    return found
+
+
+def get_chunks(session_id: str, ids):
+    """ฝั่ง Query: อ่าน Chunk ตาม id แบบ Read-only (คืน {} ถ้า Session ยังไม่มี Store)"""
+    path = _path(session_id)
+    if not os.path.exists(path):
+        return {}
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return _select(conn, ids)
+    finally:
+        conn.close()
+
+
+def get_definitions(session_id: str, keys):
+    """ฝั่ง Query: โค้ดของ Definition ตาม keys = [(source, บรรทัดเริ่ม)] คืน {(source, start): code}"""
+    path = _path(session_id)
+    if not os.path.exists(path):
+        return {}
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        found = {}
+        for source, start in set(keys):
+            row = conn.execute(
+                "SELECT code FROM definitions WHERE source = ? AND start = ?", (source, start)
+            ).fetchone()
+            if row is not None:
+                found[(source, start)] = row[0]
+        return found
+    finally:
+        conn.close()
+
+
+def delete_store(session_id: str):
+    path = _path(session_id)
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(path + suffix)
+        except OSError:
+            pass
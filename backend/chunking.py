@@ -0,0 +1,215 @@
+import bisect
+import os
+import re
+
+from langchain_text_splitters import Language, RecursiveCharacterTextSplitter
+
+import file_filter
+from symbol_index import LANGUAGE_BY_EXTENSION, extract_symbols, line_offsets, symbol_entries
+
+# Chunk ของโค้ดตัดตามขอบเขต Definition (ทั้ง Function/Class) แทนการตัดทุก 1000 ตัวอักษร
+CODE_CHUNK_MAX_CHARS = int(os.environ.get("CODE_CHUNK_MAX_CHARS", "1500"))
+# ไฟล์ที่ไม่ใช่โค้ด (.md, .txt, .html, .css) ยังใช้ Splitter ตัวอักษร
+TEXT_CHUNK_SIZE = 1000
+TEXT_CHUNK_OVERLAP = 200
+TEXT_SEPARATORS = ["\n\n", "\n", " ", ""]
+
+# Splitter สร้างครั้งเดียวต่อภาษา (นามสกุลที่ไม่อยู่ในนี้ใช้ TEXT_SEPARATORS)
+TEXT_LANGUAGES = {".md": Language.MARKDOWN, ".html": Language.HTML}
+
+_BLANK_LINE = re.compile(r"^[ \t\r\f\v]*$\n?", re.M)
+_splitters = {}
+
+
+def text_splitter(extension: str):
+    splitter = _splitters.get(extension)
+    if splitter is None:
+        language = TEXT_LANGUAGES.get(extension)
+        if language is not None:
+            splitter = RecursiveCharacterTextSplitter.from_language(
+                language, chunk_size=TEXT_CHUNK_SIZE, chunk_overlap=TEXT_CHUNK_OVERLAP
+            )
+        else:
+            splitter = RecursiveCharacterTextSplitter(
+                chunk_size=TEXT_CHUNK_SIZE, chunk_overlap=TEXT_CHUNK_OVERLAP, separators=TEXT_SEPARATORS
+            )
+        _splitters[extension] = splitter
+    return splitter
+
+
+class _CodeChunker:
+    """ตัดไฟล์โค้ดเดียวด้วยตำแหน่ง (Offset) ล้วนๆ: ไม่แตกไฟล์เป็น list ของบรรทัด ขนาด Segment คำนวณได้ O(1)
+
+    บรรทัดเป็น 0-based ช่วงครึ่งเปิด [start, end) และบรรทัด i = text[offsets[i]:offsets[i + 1]]
+    """
+
+    def __init__(self, text: str, max_chars: int):
+        self.text = text
+        self.max_chars = max_chars
+        self.offsets = line_offsets(text)
+        self.blank_lines = []
+        for m in _BLANK_LINE.finditer(text):
+            if m.end() > m.start():
+                self.blank_lines.append(bisect.bisect_right(self.offsets, m.start()) - 1)
+
+    def size(self, start: int, end: int) -> int:
+        return self.offsets[end] - self.offsets[start]
+
+    def slice(self, start: int, end: int) -> str:
+        return self.text[self.offsets[start]:self.offsets[end]]
+
+    def pack_lines(self, start: int, end: int, max_chars: int):
+        """ตัด Block ที่ใหญ่เกินตามบรรทัด (ไม่มี Overlap) บรรทัดเดียวที่ยาวเกินจะถูกตัดตามตัวอักษร"""
+        offsets = self.offsets
+        pieces = []
+        line = start
+        while line < end:
+            # บรรทัดสุดท้ายที่ยังใส่ได้ใน max_chars หาด้วย Binary Search บน Offset
+            stop = min(end, bisect.bisect_right(offsets, offsets[line] + max_chars) - 1)
+            if stop > line:
+                pieces.append(self.slice(line, stop))
+                line = stop
+                continue
+            for position in range(offsets[line], offsets[line + 1], max_chars):
+                pieces.append(self.text[position:min(position + max_chars, offsets[line + 1])])
+            line += 1
+        return pieces
+
+    def paragraphs(self, start: int, end: int):
+        """โค้ดนอก Definition (import, ค่าคงที่ ฯลฯ) แยกเป็นย่อหน้าตามบรรทัดว่าง"""
+        segments = []
+        block_start = start
+        first = bisect.bisect_left(self.blank_lines, start)
+        last = bisect.bisect_left(self.blank_lines, end)
+        for blank in self.blank_lines[first:last]:
+            segments.append((block_start, blank + 1, False))
+            block_start = blank + 1
+        if block_start < end:
+            segments.append((block_start, end, False))
+        return segments
+
+    def split_region(self, lo: int, hi: int, spans, max_chars: int):
+        """แบ่งบรรทัด [lo, hi) เป็น Chunk: Definition ทั้งก้อน + โค้ดระหว่าง Definition แยกตามบรรทัดว่าง
+        แล้วรวม Segment ที่ติดกันจนเกือบเต็ม max_chars (Chunk ที่ได้เป็นช่วงต่อเนื่อง ตัดจาก text ทีเดียว)
+        """
+        segments = []  # (start, end, is_definition)
+        cursor = lo
+        for start, end in _outermost(spans, lo, hi):
+            segments.extend(self.paragraphs(cursor, start))
+            segments.append((start, end, True))
+            cursor = end
+        segments.extend(self.paragraphs(cursor, hi))
+
+        chunks = []
+        current = None  # บรรทัดเริ่มของ Chunk ที่กำลังรวม
+        current_end = lo
+        for start, end, is_definition in segments:
+            if self.size(start, end) > max_chars:
+                if current is not None:
+                    chunks.append(self.slice(current, current_end))
+                    current = None
+                chunks.extend(self.split_definition(start, end, spans, max_chars) if is_definition
+                              else self.pack_lines(start, end, max_chars))
+                continue
+            if current is not None and self.size(current, end) > max_chars:
+                chunks.append(self.slice(current, current_end))
+                current = None
+            if current is None:
+                current = start
+            current_end = end
+        if current is not None:
+            chunks.append(self.slice(current, current_end))
+        return chunks
+
+    def split_definition(self, start: int, end: int, spans, max_chars: int):
+        """Definition ที่ใหญ่เกิน (เช่น Class ยาว) ตัดตาม Method ข้างใน และใส่บรรทัดหัว Class ไว้ทุก Chunk"""
+        inner = [(s, e) for s, e in spans if start <= s and e <= end and (s, e) != (start, end)]
+        if not inner:
+            return self.pack_lines(start, end, max_chars)
+        header_line = start
+        while header_line < end - 1 and self.text.startswith("@", self.offsets[header_line] + self._indent(header_line)):
+            header_line += 1
+        header = self.slice(header_line, header_line + 1)
+        chunks = self.split_region(start, end, inner, max(max_chars - len(header), 1))
+        return chunks[:1] + [chunk if chunk.startswith(header) else header + chunk for chunk in chunks[1:]]
+
+    def _indent(self, line: int) -> int:
+        text, position, stop = self.text, self.offsets[line], self.offsets[line + 1]
+        indent = 0
+        while position + indent < stop and text[position + indent] in " \t":
+            indent += 1
+        return indent
+
+
+def _outermost(spans, lo: int, hi: int):
+    """Span (0-based, ครึ่งเปิด) ที่อยู่ใน [lo, hi) และไม่ซ้อนอยู่ในตัวอื่น เรียงตามบรรทัด"""
+    result = []
+    last_end = lo
+    for start, end in sorted(spans, key=lambda span: (span[0], -span[1])):
+        if start >= last_end and start < hi:
+            result.append((start, min(end, hi)))
+            last_end = min(end, hi)
+    return result
+
+
+def chunk_code(path: str, text: str, max_chars: int = CODE_CHUNK_MAX_CHARS, symbols=None):
+    """ตัดไฟล์โค้ดตามขอบเขต Syntax (ast สำหรับ .py, ปีกกา/ย่อหน้าสำหรับภาษาอื่น)
+
+    symbols = ผลของ extract_symbols ที่มีอยู่แล้ว (ไม่ต้อง Parse ไฟล์ซ้ำ)
+    """
+    if symbols is None:
+        symbols = extract_symbols(path, text)
+    chunker = _CodeChunker(text, max_chars)
+    spans = [(symbol["start"] - 1, symbol["end"]) for symbol in symbols]
+    chunks = chunker.split_region(0, len(chunker.offsets) - 1, spans, max_chars)
+    return [chunk for chunk in chunks if chunk and not chunk.isspace()]
+
+
+def chunk_file(path: str, text: str, symbols=None):
+    """คืน list ของข้อความ Chunk ของไฟล์ (โค้ดที่มี Definition ใช้ chunk_code, นอกนั้นใช้ Splitter ตัวอักษร)"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in LANGUAGE_BY_EXTENSION:
+        if symbols is None:
+            symbols = extract_symbols(path, text)
+        # ไม่มี Definition ไม่มีขอบเขตให้ตัด ใช้ Splitter ที่ Cache ไว้แทน
+        if symbols:
+            return chunk_code(path, text, symbols=symbols)
+    return text_splitter(extension).split_text(text)
+
+
+def read_source(source) -> str:
+    """อ่านไฟล์เป็น str ให้ได้ผลเหมือน open(..., errors='ignore') ทั้งจาก Path และ bytes (รวมถึงแปลงท้ายบรรทัด CRLF/CR)"""
+    if isinstance(source, bytes):
+        return source.decode('utf-8', errors='ignore').replace('\r\n', '\n').replace('\r', '\n')
+    with open(source, 'r', encoding='utf-8', errors='ignore') as f:
+        return f.read()
+
+
+def chunk_files(files):
+    """งานหนึ่งชิ้นของ Process Pool: อ่าน -> Parse -> ตัด Chunk หลายไฟล์รวดเดียว (ลดต้นทุน IPC ต่อไฟล์)
+
+    files = [(relative_path, source)] โดย source เป็น Path บน Disk หรือเนื้อไฟล์ (bytes จาก Git Object)
+    คืน [(relative_path, chunks, symbol_entries, skipped)] ตามลำดับเดิม
+    ไฟล์ที่ถูกข้าม (Binary / Minified / Generated / อ่านไม่ได้) จะได้ chunks = None และ skipped = (เหตุผล, ขนาด)
+    """
+    results = []
+    for relative_path, source in files:
+        try:
+            content = read_source(source)
+        except Exception:
+            results.append((relative_path, None, None, ("unreadable", 0)))
+            continue
+        reason = file_filter.content_reason(relative_path, content)
+        if reason:
+            results.append((relative_path, None, None, (reason, len(content))))
+            continue
+        try:
+            # Parse ครั้งเดียว ใช้ทั้งตัด Chunk ตามขอบเขต Function/Class และสร้าง Symbol Index
+            definitions = extract_symbols(relative_path, content)
+            chunks = chunk_file(relative_path, content, definitions)
+            entries = symbol_entries(relative_path, content, definitions)
+        except Exception:
+            results.append((relative_path, None, None, ("unreadable", len(content))))
+            continue
+        results.append((relative_path, chunks, entries, None))
+    return results
@@ -0,0 +1,150 @@
+import queue
+import random
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import Future, ThreadPoolExecutor
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# Error ของ HTTP Client ที่ไม่มี status (เช่น urllib3 ที่ Pinecone ใช้) แต่เป็นปัญหาเครือข่ายชั่วคราว
+TRANSIENT_ERROR_NAMES = ("Timeout", "ConnectionError", "ProtocolError", "MaxRetryError")
+
+
+class TokenBucket:
+    """Rate Limiter แบบ Token Bucket (rate = token ต่อวินาที, capacity = burst สูงสุด)"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0):
+        """บล็อกจนกว่าจะมี Token พอ"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def error_status(error):
+    """ดึง HTTP status จาก Exception ของ google-genai / pinecone / requests (None ถ้าไม่มี)"""
+    for attr in ("code", "status_code", "status"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def is_transient_error(error):
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    if any(name in type(error).__name__ for name in TRANSIENT_ERROR_NAMES):
+        return True
+    return error_status(error) in RETRYABLE_STATUS
+
+
+def call_with_retry(fn, *args, retries: int = 5, base_delay: float = 1.0, max_delay: float = 30.0,
+                    limiter: TokenBucket = None, **kwargs):
+    """เรียก fn พร้อม Retry แบบ Exponential Backoff (Full Jitter) เมื่อเจอ 429/5xx"""
+    attempt = 0
+    while True:
+        if limiter:
+            limiter.acquire()
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt >= retries or not is_transient_error(e):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+            print(f"🔁 Transient error ({error_status(e) or type(e).__name__}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+            attempt += 1
+
+
+def bounded_map(fn, items, max_in_flight: int, executor=None):
+    """รัน fn(item) แบบขนานบน Thread Pool โดยมีงานค้างไม่เกิน max_in_flight
+
+    ดึง items แบบ Lazy และ yield (item, result, error) ตามลำดับเดิม
+    ส่ง executor (เช่น ProcessPoolExecutor ที่ใช้ร่วมกัน) มาได้ จะไม่ถูกปิดเมื่อจบ
+    ส่งงานไม่เข้า (เช่น Pool พังแล้ว) ได้ error ของ item นั้นแทน ไม่หยุดทั้ง Generator
+    """
+    with (nullcontext(executor) if executor else ThreadPoolExecutor(max_workers=max_in_flight)) as pool:
+        pending = deque()
+
+        def drain_one():
+            item, future = pending.popleft()
+            try:
+                return item, future.result(), None
+            except Exception as e:
+                return item, None, e
+
+        for item in items:
+            try:
+                future = pool.submit(fn, item)
+            except Exception as e:
+                future = Future()
+                future.set_exception(e)
+            pending.append((item, future))
+            if len(pending) >= max_in_flight:
+                yield drain_one()
+        while pending:
+            yield drain_one()
+
+
+class QueueWorkers:
+    """Worker Threads ที่ดึงงานจาก Queue แบบจำกัดขนาด (put จะบล็อกเมื่อ Queue เต็ม = Backpressure)
+
+    ถ้า Worker ตัวไหน Error, put/close จะโยน Error แรกออกมาให้ผู้เรียก
+    """
+
+    _STOP = object()
+
+    def __init__(self, fn, workers: int = 1, maxsize: int = 4, name: str = "worker"):
+        self._fn = fn
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._error = None
+        self._threads = [
+            threading.Thread(target=self._loop, name=f"{name}-{i}", daemon=True) for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                return
+            if self._error is None:
+                try:
+                    self._fn(item)
+                except Exception as e:
+                    self._error = e
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    def put(self, item):
+        self._raise_if_failed()
+        self._queue.put(item)
+
+    def close(self):
+        """รอให้งานใน Queue เสร็จทั้งหมด"""
+        for _ in self._threads:
+            self._queue.put(self._STOP)
+        for thread in self._threads:
+            thread.join()
+        self._raise_if_failed()
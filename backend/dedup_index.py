@@ -0,0 +1,173 @@
+import hashlib
+import os
+import re
+
+import numpy as np
+
+import storage
+
+# ตาราง Chunk ซ้ำต่อ Session: Chunk ที่เนื้อหาเหมือน (หรือเกือบเหมือน) Chunk ที่มีอยู่แล้ว
+# ไม่ถูก Embed / Upsert ซ้ำ แต่เก็บเป็น Reference ไปหา Chunk ต้นฉบับ (License Header, Config, ไฟล์ที่ Copy กันมา)
+DEDUP_INDEX_DIR = os.environ.get("DEDUP_INDEX_DIR", "./ingest_state/dedup")
+# Near-duplicate ด้วย SimHash 64 bit: ต่างกันไม่เกินกี่ bit ถึงนับว่าซ้ำ (0 = ตรวจแค่ซ้ำเป๊ะ)
+SIMHASH_MAX_DISTANCE = int(os.environ.get("DEDUP_SIMHASH_DISTANCE", "3"))
+# Chunk สั้นกว่านี้ (จำนวน Token) ตรวจแค่ซ้ำเป๊ะ เพราะ SimHash ของข้อความสั้นๆ ชนกันง่าย
+SIMHASH_MIN_TOKENS = 24
+SHINGLE_SIZE = 3
+# แบ่ง 64 bit เป็น Band ละ 16 bit: ถ้าต่างกัน <= 3 bit ต้องมีอย่างน้อยหนึ่ง Band ที่ตรงกันเป๊ะ
+SIMHASH_BANDS = 4
+_BAND_BITS = 64 // SIMHASH_BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+
+_TOKEN = re.compile(r"\w+")
+_token_hashes = {}  # Token -> Hash 64 bit (Token ซ้ำกันทั้ง Repo จึง Hash ครั้งเดียว)
+_TOKEN_CACHE_MAX = 200000
+_MIX = (np.uint64(0xBF58476D1CE4E5B9), np.uint64(0x94D049BB133111EB))
+_SHINGLE_PRIMES = (np.uint64(0x9E3779B97F4A7C15), np.uint64(0xC2B2AE3D27D4EB4F))
+
+
+def exact_key(text: str) -> str:
+    """Hash ของข้อความหลังยุบช่องว่าง (ต่างกันแค่ย่อหน้า / ช่องว่างท้ายบรรทัด ก็นับว่าซ้ำเป๊ะ)"""
+    return hashlib.sha1(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+def _token_hash(token: str) -> int:
+    value = _token_hashes.get(token)
+    if value is None:
+        if len(_token_hashes) >= _TOKEN_CACHE_MAX:
+            _token_hashes.clear()
+        value = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "big")
+        _token_hashes[token] = value
+    return value
+
+
+def simhash(tokens) -> int:
+    """SimHash 64 bit จากชุด Shingle (SHINGLE_SIZE คำติดกัน ไม่นับซ้ำ) คำนวณทั้งหมดด้วย numpy
+
+    Shingle ที่ซ้ำในข้อความนับครั้งเดียว ไม่งั้น Pattern ที่วนซ้ำ (เช่น ตาราง) จะครอบงำทุก bit
+    """
+    hashes = np.array([_token_hash(token) for token in tokens], dtype=np.uint64)
+    if len(hashes) >= SHINGLE_SIZE:
+        hashes = (hashes[:-2] * _SHINGLE_PRIMES[0]) ^ (hashes[1:-1] * _SHINGLE_PRIMES[1]) ^ hashes[2:]
+    shingles = np.unique(hashes)
+    # splitmix64 finalizer: กระจาย bit ของ Shingle ให้ทั่วก่อนโหวต
+    shingles = shingles ^ (shingles >> np.uint64(30))
+    shingles = shingles * _MIX[0]
+    shingles = shingles ^ (shingles >> np.uint64(27))
+    shingles = shingles * _MIX[1]
+    shingles = shingles ^ (shingles >> np.uint64(31))
+    bits = np.unpackbits(shingles.astype(">u8").view(np.uint8)).reshape(-1, 64)
+    votes = bits.sum(axis=0) * 2 > len(shingles)
+    return int.from_bytes(np.packbits(votes).tobytes(), "big")
+
+
+def _bands(fingerprint: int):
+    return [(band, (fingerprint >> (band * _BAND_BITS)) & _BAND_MASK) for band in range(SIMHASH_BANDS)]
+
+
+class DedupIndex:
+    """Chunk ต้นฉบับ (ถูก Embed) + Reference ของ Chunk ที่ซ้ำ ของ Session เดียว"""
+
+    def __init__(self):
+        self.exact = {}         # exact_key -> id ต้นฉบับ
+        self.fingerprints = {}  # id ต้นฉบับ -> (exact_key, simhash หรือ None, จำนวน Token)
+        self.bands = {}         # (band, ค่า) -> {id ต้นฉบับ}
+        self.refs = {}          # id ที่ซ้ำ -> id ต้นฉบับ
+        self.duplicates = {}    # id ต้นฉบับ -> {id ที่ซ้ำ}
+        self.sources = {}       # id -> ไฟล์
+        self.by_source = {}     # ไฟล์ -> {id}
+
+    def __len__(self):
+        return len(self.refs)
+
+    def check(self, doc_id: str, text: str, source: str):
+        """คืน id ต้นฉบับถ้า Chunk นี้ซ้ำ (และเก็บ Reference ไว้) ไม่งั้นลงทะเบียนเป็นต้นฉบับแล้วคืน None"""
+        key = exact_key(text)
+        canonical = self.exact.get(key)
+        fingerprint = None
+        tokens = _TOKEN.findall(text)
+        if canonical is None and SIMHASH_MAX_DISTANCE and len(tokens) >= SIMHASH_MIN_TOKENS:
+            fingerprint = simhash(tokens)
+            canonical = self._near(fingerprint, len(tokens))
+        if canonical is not None and canonical != doc_id:
+            self.refs[doc_id] = canonical
+            self.duplicates.setdefault(canonical, set()).add(doc_id)
+            self._track(doc_id, source)
+            return canonical
+
+        self.exact.setdefault(key, doc_id)
+        self.fingerprints[doc_id] = (key, fingerprint, len(tokens))
+        if fingerprint is not None:
+            for band in _bands(fingerprint):
+                self.bands.setdefault(band, set()).add(doc_id)
+        self._track(doc_id, source)
+        return None
+
+    def _near(self, fingerprint: int, length: int):
+        best, best_distance = None, SIMHASH_MAX_DISTANCE + 1
+        for band in _bands(fingerprint):
+            for candidate in self.bands.get(band, ()):
+                _, other, other_length = self.fingerprints[candidate]
+                # ความยาวต่างกันมาก (เช่น ต้นฉบับเป็นส่วนหนึ่งของไฟล์ที่ยาวกว่า) ไม่นับว่าซ้ำ
+                if abs(other_length - length) > max(length, other_length) // 10:
+                    continue
+                distance = bin(fingerprint ^ other).count("1")
+                if distance < best_distance:
+                    best, best_distance = candidate, distance
+        return best
+
+    def _track(self, doc_id: str, source: str):
+        self.sources[doc_id] = source
+        self.by_source.setdefault(source, set()).add(doc_id)
+
+    def _forget(self, doc_id: str):
+        source = self.sources.pop(doc_id, None)
+        ids = self.by_source.get(source)
+        if ids is not None:
+            ids.discard(doc_id)
+            if not ids:
+                del self.by_source[source]
+
+    def remove_sources(self, sources):
+        """ลบทุก Chunk ของไฟล์ใน sources คืน [(id, ไฟล์)] ของ Chunk ซ้ำในไฟล์อื่นที่ต้นฉบับหายไป (ต้องตรวจ/Embed ใหม่)"""
+        sources = set(sources)
+        orphans = set()
+        for source in sources:
+            for doc_id in list(self.by_source.get(source, ())):
+                canonical = self.refs.pop(doc_id, None)
+                if canonical is not None:
+                    self.duplicates.get(canonical, set()).discard(doc_id)
+                elif doc_id in self.fingerprints:
+                    key, fingerprint, _ = self.fingerprints.pop(doc_id)
+                    if self.exact.get(key) == doc_id:
+                        del self.exact[key]
+                    if fingerprint is not None:
+                        for band in _bands(fingerprint):
+                            members = self.bands.get(band)
+                            members.discard(doc_id)
+                            if not members:
+                                del self.bands[band]
+                    for duplicate in self.duplicates.pop(doc_id, ()):
+                        del self.refs[duplicate]
+                        orphans.add((duplicate, self.sources[duplicate]))
+                self._forget(doc_id)
+        orphans = sorted((doc_id, source) for doc_id, source in orphans if source not in sources)
+        for doc_id, _ in orphans:
+            self._forget(doc_id)
+        return orphans
+
+    def canonical(self, doc_id: str) -> str:
+        return self.refs.get(doc_id, doc_id)
+
+    def duplicate_sources(self, doc_id: str):
+        """ไฟล์อื่นที่มี Chunk ซ้ำกับ doc_id (ต้นฉบับ)"""
+        own = self.sources.get(doc_id)
+        return sorted({self.sources[d] for d in self.duplicates.get(doc_id, ())} - {own})
+
+
+# --- Persistence ---
+_store = storage.PickleStore(DEDUP_INDEX_DIR, DedupIndex)
+load_index = _store.load
+save_index = _store.save
+delete_index = _store.delete
+get_index = _store.get  # Index สำหรับฝั่ง Query (None ถ้าไม่มี)
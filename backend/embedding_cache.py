@@ -0,0 +1,158 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from lru import LRUCache
+
+# Cache ของ Embedding บน Disk ใช้ร่วมกันทุก Session (key = model + hash ของข้อความ)
+CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "./cache/embeddings.sqlite3")
+CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "100000"))
+# Cache ของ Embedding คำถามใน /ask-codebase (LRU ใน Memory + ใช้ Cache บน Disk ด้านบนเป็นชั้นที่สองถ้าเปิด)
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "2048"))
+QUERY_CACHE_DISK = os.environ.get("QUERY_CACHE_DISK", "").lower() in ("1", "true", "yes")
+# Embedding ของคำถามใช้ Task type ต่างจากของ Chunk จึงแยก Key space บนตารางเดียวกัน
+QUERY_KEY_PREFIX = "query:"
+
+
+def text_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite Cache แบบ LRU: เก็บ Vector เป็น float32 bytes และไล่ตัวที่ไม่ได้ใช้นานที่สุดออกเมื่อเกิน max_entries"""
+
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    def get_many(self, model: str, texts, count: bool = True):
+        """คืน list ยาวเท่า texts: Vector ที่เจอใน Cache หรือ None ถ้าไม่เจอ
+
+        count=False: ไม่นับเข้า hits/misses ของ Ingest (ผู้เรียกนับสถิติเอง)
+        """
+        keys = [text_key(model, t) for t in texts]
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, k) for k in found]
+                )
+                self._conn.commit()
+            results = []
+            for key in keys:
+                blob = found.get(key)
+                results.append(array("f", blob).tolist() if blob is not None else None)
+            if count:
+                hit_count = sum(1 for k in keys if k in found)
+                self.hits += hit_count
+                self.misses += len(keys) - hit_count
+        return results
+
+    def put_many(self, model: str, texts, vectors):
+        now = time.time()
+        rows = [(text_key(model, t), array("f", v).tobytes(), now) for t, v in zip(texts, vectors)]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN"
+                " (SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)", (overflow,)
+            )
+
+    def stats(self):
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        return {"entries": count, "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Cache ตัวเดียวต่อ Process (None ถ้าปิดด้วย EMBEDDING_CACHE_PATH ว่าง)"""
+    global _cache
+    if not CACHE_PATH:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+        return _cache
+
+
+def normalize_query(text: str) -> str:
+    """คำถามที่ต่างกันแค่ช่องว่าง/ตัวพิมพ์ ถือว่าเป็นคำถามเดียวกัน"""
+    return " ".join(text.split()).lower()
+
+
+class QueryEmbeddingCache:
+    """Cache 2 ชั้นสำหรับ Embedding ของคำถาม: LRU ใน Process -> SQLite ที่ใช้ร่วมกัน (ถ้ามี)"""
+
+    def __init__(self, maxsize: int = QUERY_CACHE_SIZE, disk: EmbeddingCache = None):
+        self.memory = LRUCache(maxsize=maxsize)
+        self.disk = disk
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get_memory(self, model: str, query: str):
+        return self.memory.get((model, query))
+
+    def get_disk(self, model: str, query: str):
+        """ค้นบน Disk (Blocking) ถ้าเจอจะดึงขึ้น Memory ด้วย"""
+        vector = self.disk.get_many(QUERY_KEY_PREFIX + model, [query], count=False)[0] if self.disk else None
+        if vector is not None:
+            self.disk_hits += 1
+            self.memory.put((model, query), vector)
+        return vector
+
+    def record_miss(self):
+        self.misses += 1
+
+    def put(self, model: str, query: str, vector):
+        self.memory.put((model, query), vector)
+        if self.disk:
+            self.disk.put_many(QUERY_KEY_PREFIX + model, [query], [vector])
+
+    def stats(self):
+        memory = self.memory.stats()
+        total = memory["hits"] + self.disk_hits + self.misses
+        return {
+            "memory": memory,
+            "disk_enabled": self.disk is not None,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((memory["hits"] + self.disk_hits) / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,177 @@
+import os
+import re
+import threading
+
+# ไฟล์ที่ Ingest ได้ (นามสกุลอื่นไม่ถูกดึง / อ่านเลย)
+INGEST_EXTENSIONS = ('.py', '.js', '.jsx', '.ts', '.tsx', '.md', '.txt', '.html', '.css', '.java', '.cs', '.go', '.php')
+# ไฟล์ Ignore ที่อ่านจาก Repo (.ragignore ใช้ Syntax เดียวกับ .gitignore แต่มีผลเฉพาะการ Ingest)
+IGNORE_FILES = ('.gitignore', '.ragignore')
+
+# ขนาดสูงสุดต่อไฟล์ (bytes) + ค่าเฉพาะนามสกุล เช่น INGEST_SIZE_LIMITS=".txt=65536,.md=131072"
+MAX_FILE_BYTES = int(os.environ.get("INGEST_MAX_FILE_BYTES", str(256 * 1024)))
+SIZE_LIMITS = {".txt": 64 * 1024}
+SIZE_LIMITS.update(
+    (ext.strip(), int(limit))
+    for ext, _, limit in (item.partition("=") for item in os.environ.get("INGEST_SIZE_LIMITS", "").split(","))
+    if ext.strip() and limit.strip()
+)
+
+# โฟลเดอร์ Dependency / Build Output (ยกเลิกได้ด้วย !pattern ใน .ragignore)
+VENDORED_PATTERNS = (
+    ".git/", "node_modules/", "bower_components/", "vendor/", "third_party/", "third-party/",
+    "dist/", ".next/", "coverage/", "__pycache__/", ".venv/", "venv/", "site-packages/",
+)
+# ชื่อไฟล์ที่เป็นโค้ด Generate / Bundle
+GENERATED_PATTERNS = (
+    "*.min.js", "*.min.css", "*.bundle.js", "*.chunk.js", "*.pb.go", "*_pb2.py", "*_pb2_grpc.py",
+    "*.pb.gw.go", "zz_generated*.go", "*_generated.go", "*.generated.*", "*.g.cs", "*.designer.cs",
+    "*.Designer.cs",
+)
+# ข้อความในหัวไฟล์ที่บอกว่าเป็นไฟล์ Generate
+GENERATED_MARKERS = (
+    "@generated", "code generated by", "<auto-generated", "autogenerated by", "generated by the protocol buffer compiler",
+    "this file was automatically generated", "this file is automatically generated",
+)
+# Minified: บรรทัดเฉลี่ยยาวเกิน หรือมีบรรทัดยาวมากๆ (ไม่ตรวจ .md / .txt ที่ย่อหน้าหนึ่งเป็นบรรทัดเดียวได้)
+MINIFIED_AVG_LINE = 300
+MINIFIED_MAX_LINE = 5000
+PROSE_EXTENSIONS = ('.md', '.txt')
+
+
+def _translate(pattern: str) -> str:
+    """แปลง Glob แบบ .gitignore เป็น Regex (* ไม่ข้าม /, ** ข้ามได้)"""
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 1:]:
+            end = pattern.index("]", i + 1)
+            members = pattern[i + 1:end]
+            parts.append("[" + ("^" + members[1:] if members.startswith("!") else members) + "]")
+            i = end + 1
+        elif pattern[i] == "\\" and i + 1 < len(pattern):
+            parts.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return "".join(parts)
+
+
+def compile_rule(pattern: str, base: str = ""):
+    """คืน (regex, negate) ของ 1 บรรทัดใน .gitignore ที่อยู่ในโฟลเดอร์ base (None ถ้าเป็นบรรทัดว่าง/Comment)"""
+    pattern = pattern.rstrip("\n\r")
+    if not pattern.strip() or pattern.startswith("#"):
+        return None
+    pattern = pattern.rstrip(" ")
+    negate = pattern.startswith("!")
+    if negate:
+        pattern = pattern[1:]
+    dir_only = pattern.endswith("/")
+    pattern = pattern.strip("/") if dir_only else pattern
+    anchored = "/" in pattern.rstrip("/")
+    pattern = pattern.lstrip("/")
+    if not pattern:
+        return None
+    prefix = re.escape(base + "/") if base else ""
+    body = _translate(pattern)
+    if not anchored:
+        body = "(?:.*/)?" + body
+    # Pattern ที่ตรงกับโฟลเดอร์ จะครอบทุกไฟล์ข้างใน, dir_only ต้องเป็นโฟลเดอร์เท่านั้น
+    suffix = "/.*" if dir_only else "(?:/.*)?"
+    return re.compile(f"^{prefix}{body}{suffix}$"), negate
+
+
+class FileFilter:
+    """ตัดสินว่าไฟล์ไหนควร Ingest + เก็บสถิติไฟล์/bytes ที่ถูกข้าม (แยกตามเหตุผล)"""
+
+    def __init__(self, ignore_sources=None):
+        """ignore_sources = [(โฟลเดอร์ของไฟล์ ignore, เนื้อไฟล์)] ไฟล์ที่ลึกกว่ามาทีหลัง (มีผลเหนือกว่า)"""
+        self.rules = []  # (regex, negate, reason) กฎหลังสุดที่ตรงชนะ
+        for pattern in VENDORED_PATTERNS:
+            self._add(pattern, "", "vendored")
+        for pattern in GENERATED_PATTERNS:
+            self._add(pattern, "", "generated")
+        for base, text in ignore_sources or []:
+            for line in text.splitlines():
+                self._add(line, base, "ignored")
+        self.skipped_files = {}
+        self.skipped_bytes = {}
+        self._lock = threading.Lock()
+
+    def _add(self, pattern: str, base: str, reason: str):
+        rule = compile_rule(pattern, base)
+        if rule:
+            self.rules.append((rule[0], rule[1], reason))
+
+    def path_reason(self, path: str):
+        """เหตุผลที่ไม่ Ingest จาก Path อย่างเดียว (None = Ingest ได้)"""
+        if not path.endswith(INGEST_EXTENSIONS):
+            return "extension"
+        reason = None
+        for regex, negate, rule_reason in self.rules:
+            if regex.match(path):
+                reason = None if negate else rule_reason
+        return reason
+
+    def allows(self, path: str) -> bool:
+        return self.path_reason(path) is None
+
+    def record(self, reason: str, size: int = 0):
+        with self._lock:
+            self.skipped_files[reason] = self.skipped_files.get(reason, 0) + 1
+            self.skipped_bytes[reason] = self.skipped_bytes.get(reason, 0) + size
+
+    def report(self):
+        with self._lock:
+            return {
+                "files": dict(self.skipped_files),
+                "bytes": dict(self.skipped_bytes),
+                "total_bytes": sum(self.skipped_bytes.values()),
+            }
+
+
+def ignore_files(blobs):
+    """Path ของ .gitignore / .ragignore ใน Tree เรียงจากตื้นไปลึก"""
+    paths = [p for p in blobs if os.path.basename(p) in IGNORE_FILES]
+    return sorted(paths, key=lambda p: (p.count("/"), p))
+
+
+def build_filter(blobs, read_text):
+    """สร้าง FileFilter จากไฟล์ ignore ใน Tree (read_text(path) -> str)"""
+    sources = []
+    for path in ignore_files(blobs):
+        try:
+            sources.append((os.path.dirname(path), read_text(path)))
+        except Exception as e:
+            print(f"⚠️ Could not read {path}: {e}")
+    return FileFilter(sources)
+
+
+def size_limit(path: str) -> int:
+    return SIZE_LIMITS.get(os.path.splitext(path)[1].lower(), MAX_FILE_BYTES)
+
+
+def content_reason(path: str, text: str):
+    """เหตุผลที่ไม่ Ingest จากเนื้อไฟล์: binary / generated / minified (None = Ingest ได้)"""
+    if "\x00" in text[:8192]:
+        return "binary"
+    head = text[:2048].lower()
+    if any(marker in head for marker in GENERATED_MARKERS):
+        return "generated"
+    if not path.endswith(PROSE_EXTENSIONS) and len(text) > 1000:
+        lines = text.count("\n") + 1
+        if len(text) / lines > MINIFIED_AVG_LINE or max(map(len, text.split("\n"))) > MINIFIED_MAX_LINE:
+            return "minified"
+    return None
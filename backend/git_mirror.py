@@ -0,0 +1,108 @@
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+
+import git
+
+import storage
+
+# Bare Mirror ต่อ Repo URL เก็บถาวรไว้บน Disk: Ingest ครั้งต่อไปแค่ fetch Object ใหม่
+MIRROR_DIR = os.environ.get("REPO_MIRROR_DIR", "./cache/mirrors")
+# objects = อ่าน Blob จาก Mirror ตรงๆ ไม่ Checkout (ค่าเริ่มต้น), mirror = Mirror + Sparse Checkout,
+# shallow = clone --depth=1 ทั้ง Tree แบบเดิม
+CLONE_MODE = os.environ.get("REPO_CLONE_MODE", "objects")
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def _lock_for(path: str):
+    with _locks_lock:
+        return _locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+def mirror_path(repo_url: str) -> str:
+    """Mirror ใช้ร่วมกันทุก URL ที่ชี้ Repo เดียวกัน (x, x.git, x/, ssh / https)"""
+    url = storage.normalize_url(repo_url)
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", url.rsplit("/", 1)[-1])[:40]
+    digest = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(MIRROR_DIR, f"{name}-{digest}.git")
+
+
+def _clone_mirror(repo_url: str, path: str):
+    """Clone แบบ Blobless (--filter=blob:none): ได้แค่ Commit + Tree ส่วน Blob ดึงเฉพาะที่ต้องใช้ทีหลัง"""
+    os.makedirs(MIRROR_DIR, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix=os.path.basename(path) + ".tmp-", dir=MIRROR_DIR)
+    try:
+        git.Repo.clone_from(repo_url, tmp_path, multi_options=["--mirror", "--filter=blob:none"])
+        os.replace(tmp_path, path)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    return git.Repo(path)
+
+
+def sync_mirror(repo_url: str):
+    """คืน git.Repo ของ Mirror ที่อัปเดตแล้ว (Clone ถ้ายังไม่มี, fetch --prune ถ้ามีแล้ว)"""
+    path = mirror_path(repo_url)
+    with _lock_for(path):
+        if not os.path.isdir(path):
+            print(f"📥 Creating blobless mirror for {repo_url}...")
+            return _clone_mirror(repo_url, path)
+        repo = git.Repo(path)
+        try:
+            print("🔄 Fetching new objects into mirror...")
+            repo.git.fetch("--prune", "origin")
+            return repo
+        except git.GitCommandError as e:
+            # Mirror เสีย (เช่น Process ตายกลาง fetch) -> ทิ้งแล้ว Clone ใหม่
+            print(f"⚠️ Mirror fetch failed, re-cloning: {e}")
+            shutil.rmtree(path, ignore_errors=True)
+            return _clone_mirror(repo_url, path)
+
+
+def fetch_blobs(repo, commit: str, oids):
+    """ดึง Blob ที่ยังไม่มีใน Mirror (เฉพาะ oids ที่ขอ) ด้วย Request เดียว คืนจำนวนที่ดึง"""
+    listing = repo.git.rev_list("--objects", "--missing=print", "--no-walk", commit)
+    missing = sorted({line[1:] for line in listing.splitlines() if line.startswith("?")} & set(oids))
+    if not missing:
+        return 0
+    with _lock_for(repo.git_dir):
+        # คำสั่งเดียวกับที่ git ใช้ดึง Object ของ Partial Clone (แต่ส่งทีเดียวทั้งชุด แทนทีละตัว)
+        subprocess.run(
+            ["git", "-C", repo.git_dir, "-c", "fetch.negotiationAlgorithm=noop", "fetch", "origin",
+             "--no-tags", "--no-write-fetch-head", "--recurse-submodules=no", "--filter=blob:none", "--stdin"],
+            input="\n".join(missing) + "\n", text=True, capture_output=True, check=True,
+        )
+    return len(missing)
+
+
+def _sparse_pattern(path: str) -> str:
+    """Pattern แบบ no-cone ที่ตรงกับไฟล์นี้ไฟล์เดียว (escape อักขระ Glob)"""
+    return "/" + re.sub(r"([\\*?\[\]!# ])", r"\\\1", path)
+
+
+def sparse_checkout(repo, commit: str, paths, repo_path: str):
+    """Checkout เฉพาะ paths ของ commit ลง repo_path โดยใช้ Object ของ Mirror ร่วมกัน (--shared ไม่ Copy)"""
+    work = git.Repo.clone_from(repo.git_dir, repo_path, multi_options=["--shared", "--no-checkout"])
+    patterns = "\n".join(_sparse_pattern(p) for p in paths) + "\n"
+    subprocess.run(
+        ["git", "-C", repo_path, "sparse-checkout", "set", "--no-cone", "--stdin"],
+        input=patterns, text=True, capture_output=True, check=True,
+    )
+    work.git.checkout("--detach", commit)
+    return work
+
+
+def read_blob(repo, sha: str) -> bytes:
+    """อ่านเนื้อ Blob จาก Object Database ผ่าน git cat-file --batch ตัวเดียวที่เปิดค้างไว้ของ repo (ไม่ Thread-safe)"""
+    return repo.git.get_object_data(sha)[3]
+
+
+def blob_size(repo, sha: str) -> int:
+    """ขนาด Blob จาก Header (git cat-file --batch-check) ไม่ต้องอ่านเนื้อไฟล์"""
+    return repo.git.get_object_header(sha)[2]
@@ -0,0 +1,168 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Config ของ Job Queue
+MAX_INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "2"))
+JOB_RETENTION_SECONDS = int(os.environ.get("INGEST_JOB_RETENTION", "3600"))
+
+PHASES = ("clone", "split", "embed", "upsert")
+
+
+class NullProgress:
+    """Progress แบบไม่ทำอะไร (ใช้ตอนเรียก ingest_repo ตรงๆ ไม่ผ่าน Job)"""
+
+    def set_phase(self, phase):
+        pass
+
+    def update(self, **counters):
+        pass
+
+    def incr(self, key, n=1):
+        pass
+
+
+class IngestJob:
+    """สถานะของงาน Ingest หนึ่งงาน (Thread-safe)"""
+
+    def __init__(self, repo_url: str, session_id: str, scope: str, options=None):
+        self.id = uuid.uuid4().hex
+        self.repo_url = repo_url
+        self.session_id = session_id
+        self.scope = scope  # Key ของ Repo ใน Session (URL คนละรูปของ Repo เดียวกันได้ scope เดียวกัน)
+        self.options = options or {}
+        self.status = "queued"
+        self.phase = None
+        self.counters = {}
+        self.phase_timings = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._phase_started_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def _close_phase(self, now):
+        if self.phase and self._phase_started_at is not None:
+            elapsed = now - self._phase_started_at
+            self.phase_timings[self.phase] = round(self.phase_timings.get(self.phase, 0.0) + elapsed, 3)
+
+    def start(self):
+        with self._lock:
+            self.status = "running"
+            self.started_at = time.time()
+
+    def set_phase(self, phase):
+        with self._lock:
+            now = time.time()
+            self._close_phase(now)
+            self.phase = phase
+            self._phase_started_at = now
+
+    def update(self, **counters):
+        with self._lock:
+            self.counters.update(counters)
+
+    def incr(self, key, n=1):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def finish(self, result=None, error=None):
+        with self._lock:
+            now = time.time()
+            self._close_phase(now)
+            self._phase_started_at = None
+            self.finished_at = now
+            self.result = result
+            self.error = error
+            self.status = "failed" if error else "done"
+
+    def to_dict(self):
+        with self._lock:
+            end = self.finished_at or time.time()
+            return {
+                "job_id": self.id,
+                "session_id": self.session_id,
+                "repo_url": self.repo_url,
+                "status": self.status,
+                "phase": self.phase,
+                "progress": dict(self.counters),
+                "timings": {
+                    "created_at": self.created_at,
+                    "started_at": self.started_at,
+                    "finished_at": self.finished_at,
+                    "queued_seconds": round((self.started_at or end) - self.created_at, 3),
+                    "elapsed_seconds": round(end - self.started_at, 3) if self.started_at else 0.0,
+                    "phases": dict(self.phase_timings),
+                },
+                "result": self.result,
+                "error": self.error,
+            }
+
+
+class JobManager:
+    """รัน Ingest Job บน Worker Pool ที่จำกัดจำนวน เพื่อไม่ให้ Event Loop ของ API ค้าง"""
+
+    def __init__(self, max_workers: int = MAX_INGEST_WORKERS, retention: int = JOB_RETENTION_SECONDS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._retention = retention
+
+    def submit(self, fn, repo_url: str, session_id: str, scope: str, **options):
+        """สร้าง Job ใหม่ ถ้า scope นี้ (Repo นี้ใน Session นี้) มี Job ค้างอยู่แล้วจะคืน (None, job เดิม)
+
+        Repo อื่นใน Session เดียวกัน Ingest พร้อมกันได้ (ข้อมูลแยกกันตาม scope)
+        """
+        with self._lock:
+            self._prune()
+            running = self._running(scope)
+            if running:
+                return None, running
+
+            job = IngestJob(repo_url, session_id, scope, options)
+            self._jobs[job.id] = job
+
+        self._executor.submit(self._run, job, fn)
+        return job, None
+
+    def _running(self, scope: str):
+        for job in self._jobs.values():
+            if job.scope == scope and job.active:
+                return job
+        return None
+
+    def running(self, scope: str):
+        """Job ที่ยังไม่จบของ scope นี้ (None ถ้าไม่มี)"""
+        with self._lock:
+            return self._running(scope)
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, fn):
+        job.start()
+        try:
+            result = fn(job.repo_url, job.session_id, progress=job, **job.options)
+            job.finish(result=result)
+        except Exception as e:
+            print(f"❌ Ingest job {job.id} failed: {e}")
+            job.finish(error=str(e))
+
+    def _prune(self):
+        # ลบ Job ที่จบไปนานแล้วออก กัน Memory โต
+        cutoff = time.time() - self._retention
+        expired = [jid for jid, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]
+        for jid in expired:
+            del self._jobs[jid]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
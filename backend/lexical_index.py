@@ -0,0 +1,128 @@
+import math
+import os
+import re
+from array import array
+from collections import Counter
+
+import storage
+
+# Inverted Index (BM25) ต่อ Session สำหรับค้นชื่อ Identifier ตรงๆ ที่ Embedding จับได้ไม่ดี
+LEXICAL_INDEX_DIR = os.environ.get("LEXICAL_INDEX_DIR", "./ingest_state/lexical")
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+# จำนวน Index (Posting ของทั้ง Repo) ที่ถือไว้ใน Memory ฝั่ง Query พร้อมกัน
+LEXICAL_CACHE_SIZE = int(os.environ.get("LEXICAL_CACHE_SIZE", "8"))
+
+# คำภาษาอังกฤษทั่วไปในคำถาม ไม่ช่วยแยก Chunk
+STOP_WORDS = frozenset((
+    "a", "an", "and", "are", "as", "be", "do", "does", "for", "how", "in", "is", "it", "of",
+    "on", "or", "the", "this", "that", "to", "what", "where", "which", "why", "with",
+))
+
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_CAMEL_PARTS = re.compile(r"[A-Z]+(?=[A-Z][a-z]|\d|\b)|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+
+def tokenize(text: str):
+    """ตัดคำแบบเข้าใจ Identifier: เก็บทั้งชื่อเต็ม และส่วนย่อยจาก snake_case / camelCase
+
+    "ingest_repo" -> ingest_repo, ingest, repo
+    "PINECONE_INDEX_NAME" -> pinecone_index_name, pinecone, index, name
+    "getHTTPResponse" -> gethttpresponse, get, http, response
+    """
+    tokens = []
+    for identifier in _IDENTIFIER.findall(text):
+        lowered = identifier.lower()
+        if len(lowered) > 1 and lowered not in STOP_WORDS:
+            tokens.append(lowered)
+        parts = [p.lower() for piece in identifier.split("_") for p in _CAMEL_PARTS.findall(piece)]
+        if len(parts) > 1:
+            tokens.extend(p for p in parts if len(p) > 1 and p not in STOP_WORDS)
+    return tokens
+
+
+class LexicalIndex:
+    """BM25 บน Chunk ของ Session เดียว เก็บแค่ Posting + ความยาว (เนื้อหา Chunk อยู่ใน chunk_store บน Disk)"""
+
+    def __init__(self):
+        self.docs = {}      # doc_id -> (length, array ของ term id ที่อยู่ใน Chunk ไว้ใช้ตอนลบ)
+        self.postings = {}  # term -> {doc_id: tf}
+        self.terms = []     # term id -> term
+        self.term_ids = {}  # term -> term id
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.docs
+
+    def _term_array(self, counts):
+        ids = array("I")
+        for term in counts:
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                term_id = self.term_ids[term] = len(self.terms)
+                self.terms.append(term)
+            ids.append(term_id)
+        return ids
+
+    def add(self, doc_id: str, text: str):
+        if doc_id in self.docs:
+            self.remove([doc_id])
+        counts = Counter(tokenize(text))
+        length = sum(counts.values())
+        self.docs[doc_id] = (length, self._term_array(counts))
+        self.total_length += length
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+
+    def remove(self, doc_ids):
+        for doc_id in doc_ids:
+            entry = self.docs.pop(doc_id, None)
+            if entry is None:
+                continue
+            self.total_length -= entry[0]
+            for term_id in entry[1]:
+                term = self.terms[term_id]
+                posting = self.postings.get(term)
+                if posting is not None:
+                    posting.pop(doc_id, None)
+                    if not posting:
+                        del self.postings[term]
+
+    def search(self, query: str, top_k: int = 5):
+        """คืน [(doc_id, score)] เรียงจากคะแนน BM25 มากไปน้อย"""
+        n = len(self.docs)
+        if not n:
+            return []
+        avg_length = self.total_length / n or 1.0
+        scores = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc_id, tf in posting.items():
+                length = self.docs[doc_id][0]
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+
+def reciprocal_rank_fusion(rankings, k: int = RRF_K):
+    """รวมหลายอันดับ (list ของ doc_id) ด้วย RRF: score = Σ 1 / (k + rank)"""
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused, key=fused.get, reverse=True)
+
+
+# --- Persistence ---
+_store = storage.PickleStore(LEXICAL_INDEX_DIR, LexicalIndex, LEXICAL_CACHE_SIZE)
+load_index = _store.load
+save_index = _store.save
+delete_index = _store.delete
+get_index = _store.get  # Index สำหรับฝั่ง Query (None ถ้าไม่มี)
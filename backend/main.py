@@ -1,10 +1,23 @@
 from fastapi import FastAPI, HTTPException, Body
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 import rag_engine
+import embedding_cache
+import session_state
+import vector_store
+import lexical_index
+import chunk_store
+import dedup_index
+import symbol_index
+from answer_cache import AnswerCache
+from jobs import JobManager
 import os
+import asyncio
+import json
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from pinecone import Pinecone
 from google import genai
 import logging
 
@@ -12,25 +25,64 @@ load_dotenv()
 
 # Setup Clients & Logging
 client = None
-pc = None
 index = None
 logger = logging.getLogger("backend")
 logging.basicConfig(level=logging.INFO)
 
+# Ingest รันบน Worker Pool แยก ไม่บล็อก Event Loop ของ /ask-codebase
+job_manager = JobManager()
+
+# Pinecone client เป็นแบบ Blocking -> โยนไปรันบน Thread Pool ที่กำหนดขนาดไว้ แทนการบล็อก Event Loop
+QUERY_THREADS = int(os.environ.get("QUERY_THREADS", "32"))
+query_executor = ThreadPoolExecutor(max_workers=QUERY_THREADS, thread_name_prefix="query")
+
+async def run_blocking(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(query_executor, partial(fn, *args, **kwargs))
+
+query_cache = embedding_cache.QueryEmbeddingCache(
+    disk=embedding_cache.get_cache() if embedding_cache.QUERY_CACHE_DISK else None
+)
+
+answer_cache = AnswerCache()
+
+async def embed_query(user_query: str):
+    """Embed คำถาม โดยเช็ค Cache (Memory -> Disk) ก่อนเรียก Gemini
+
+    Key ของ Cache คือคำถามที่ Normalize แล้ว แต่ส่งคำถามเดิมไป Embed (ไม่ทิ้งตัวพิมพ์ของชื่อ Identifier)
+    """
+    model = rag_engine.EMBEDDING_MODEL
+    normalized = embedding_cache.normalize_query(user_query)
+    vector = query_cache.get_memory(model, normalized)
+    if vector is None and query_cache.disk:
+        vector = await run_blocking(query_cache.get_disk, model, normalized)
+    if vector is None:
+        query_cache.record_miss()
+        # ใช้ Async Client ไม่บล็อก Event Loop
+        result = await client.aio.models.embed_content(model=model, contents=user_query)
+        vector = result.embeddings[0].values
+        await run_blocking(query_cache.put, model, normalized, vector)
+    return vector
+
 app = FastAPI(title="AI Developer Assistant API")
 
 @app.on_event("startup")
 def startup_event():
-    global client, pc, index
+    global client, index
+    rag_engine.cleanup_stale_workspaces()
     gemini_key = os.environ.get("GEMINI_API_KEY")
-    pinecone_key = os.environ.get("PINECONE_API_KEY")
 
     if gemini_key:
         client = genai.Client(api_key=gemini_key)
     
-    if pinecone_key:
-        pc = Pinecone(api_key=pinecone_key)
-        index = pc.Index(rag_engine.PINECONE_INDEX_NAME)
+    # Pinecone หรือ Local Index ตาม VECTOR_BACKEND
+    index = vector_store.get_store()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    job_manager.shutdown()
+    rag_engine.shutdown_split_pool()
+    query_executor.shutdown(wait=False)
 
 app.add_middleware(
     CORSMiddleware,
@@ -42,8 +94,9 @@ app.add_middleware(
 
 # ✅ อัปเดต Model ให้รับ session_id
 class RepoRequest(BaseModel):
-    repo_url: str
+    repo_url: str  # เพิ่ม / อัปเดต Repo นี้ใน Session (Repo อื่นใน Session ไม่ถูกแตะ)
     session_id: str 
+    incremental: bool = True  # Embed เฉพาะไฟล์ที่เปลี่ยนจากครั้งก่อน
 
 class ChatRequest(BaseModel):
     question: str
@@ -53,55 +106,254 @@ class ChatRequest(BaseModel):
 def read_root():
     return {"status": "ok", "message": "🚀 AI Assistant Backend (Multi-Session Support) is running!"}
 
-@app.post("/ingest")
+@app.post("/ingest", status_code=202)
 async def ingest_repository(request: RepoRequest):
-    try:
-        # ✅ ส่ง session_id ไปให้ rag_engine
-        result = rag_engine.ingest_repo(request.repo_url, request.session_id)
-        return result
-    except Exception as e:
-        print(f"Ingest Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.post("/ask-codebase")
-async def ask_codebase(request: ChatRequest):
-    try:
-        if not client or not index:
-             raise HTTPException(status_code=500, detail="AI Services not initialized")
+    # ✅ ส่งเป็น Background Job แล้วคืน job_id ทันที
+    # เช็ค Job ซ้ำด้วย scope (URL คนละรูปของ Repo เดียวกัน เช่น x กับ x.git ได้ scope เดียวกัน)
+    scope = await run_blocking(session_state.repo_scope, request.session_id, request.repo_url)
+    job, running = job_manager.submit(
+        rag_engine.ingest_repo, request.repo_url, request.session_id, scope,
+        incremental=request.incremental
+    )
+    if running:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Repo {request.repo_url} in session {request.session_id} already has an active ingest job: {running.id}"
+        )
+    return {
+        "job_id": job.id, "status": job.status, "session_id": job.session_id,
+        "repo_id": session_state.repo_id(request.repo_url),
+    }
 
-        user_query = request.question.strip()
+@app.get("/sessions/{session_id}/repos")
+async def list_session_repos(session_id: str):
+    """Repo ทั้งหมดใน Session พร้อม Commit ที่ Ingest ล่าสุด"""
+    repos = await run_blocking(session_state.list_repos, session_id)
+    result = []
+    for name, entry in repos.items():
+        state = await run_blocking(session_state.load_state, entry["scope"]) or {}
+        result.append({
+            "repo_id": name,
+            "repo_url": entry["repo_url"],
+            "commit": state.get("commit"),
+            "files": len(state.get("files", {})),
+            "updated_at": state.get("updated_at"),
+        })
+    return {"session_id": session_id, "repos": result}
 
-        # 1. Embed คำถาม
-        question_embedding = client.models.embed_content(
-            model="text-embedding-004",
-            contents=user_query
+@app.delete("/sessions/{session_id}/repos/{repo_id}")
+async def remove_session_repo(session_id: str, repo_id: str):
+    """ลบ Repo เดียวออกจาก Session (Repo อื่นยังค้นหาได้ตามเดิม ไม่ต้อง Ingest ใหม่)"""
+    entry = (await run_blocking(session_state.list_repos, session_id)).get(repo_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"Repo '{repo_id}' not found in session {session_id}")
+    running = job_manager.running(entry["scope"])
+    if running:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Repo '{repo_id}' in session {session_id} has an active ingest job: {running.id}"
         )
+    await run_blocking(rag_engine.remove_repo, session_id, repo_id)
+    return {"session_id": session_id, "repo_id": repo_id, "status": "removed"}
+
+@app.get("/metrics/cache")
+async def cache_metrics():
+    ingest_cache = embedding_cache.get_cache()
+    return {
+        "query_embedding": query_cache.stats(),
+        "answer": answer_cache.stats(),
+        "ingest_embedding": await run_blocking(ingest_cache.stats) if ingest_cache else None,
+    }
+
+@app.get("/ingest/{job_id}")
+async def ingest_status(job_id: str):
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.get("/symbols/{session_id}/{name}")
+async def find_symbol(session_id: str, name: str):
+    """หา Definition ตามชื่อ (เช่น ingest_repo หรือ JobManager.submit) จาก Symbol Index ของทุก Repo ใน Session"""
+    scopes = await run_blocking(session_scopes, session_id)
+    def lookup(scope):
+        symbols = symbol_index.get_index(scope)
+        return with_code(scope, symbols.lookup(name)) if symbols else []
+
+    found = await asyncio.gather(*(run_blocking(lookup, scope) for scope in scopes))
+    definitions = []
+    for repo, entries in zip(scopes.values(), found):
+        for entry in entries:
+            definitions.append({**entry, "repo": repo} if repo else entry)
+    if not definitions:
+        raise HTTPException(status_code=404, detail=f"Symbol '{name}' not found in session {session_id}")
+    return {"name": name, "definitions": definitions}
+
+async def lookup_answer(user_query: str, session_id: str):
+    """เช็ค Answer Cache ของเวอร์ชัน Corpus ปัจจุบัน คืน (cached, version, question_vector)"""
+    version = await run_blocking(session_state.corpus_version, session_id)
+    cached = answer_cache.get_exact(session_id, version, user_query)
+    if cached:
+        return cached, version, None
+    question_vector = await embed_query(user_query)
+    cached = answer_cache.get_similar(session_id, version, user_query, question_vector)
+    return cached, version, question_vector
+
+RETRIEVAL_TOP_K = 5
+# จำนวนไฟล์ที่มี Chunk ซ้ำกันที่แสดงต่อท้ายหัว Chunk ใน Context
+DUPLICATE_SOURCES_SHOWN = 5
+# Definition ที่ดึงตรงจาก Symbol Index เมื่อคำถามเอ่ยชื่อ Function/Class (ใส่ไว้ต้น Context)
+SYMBOL_MAX_DEFINITIONS = int(os.environ.get("SYMBOL_MAX_DEFINITIONS", "3"))
+
+def with_code(session_id: str, entries):
+    """ใส่โค้ดให้ Definition จาก chunk_store (Symbol Index เก็บแค่ตำแหน่ง) ตัวที่หาโค้ดไม่เจอถูกข้าม"""
+    codes = chunk_store.get_definitions(session_id, [(entry["source"], entry["start"]) for entry in entries])
+    return [
+        {**entry, "code": codes[(entry["source"], entry["start"])]}
+        for entry in entries if (entry["source"], entry["start"]) in codes
+    ]
 
-        # 2. ค้นหาแบบมี Filter (สำคัญมาก! 🔥)
-        search_results = index.query(
-            vector=question_embedding.embeddings[0].values,
-            top_k=5, 
+def lookup_definitions(user_query: str, session_id: str):
+    """หา Definition ของชื่อที่อยู่ในคำถาม (Dict Lookup ต่อชื่อ ไม่ต้องค้น Vector)"""
+    symbols = symbol_index.get_index(session_id)
+    if symbols is None:
+        return []
+    definitions = []
+    for name in symbol_index.symbols_in_question(user_query):
+        for entry in symbols.lookup(name):
+            if entry not in definitions:
+                definitions.append(entry)
+    return with_code(session_id, definitions[:SYMBOL_MAX_DEFINITIONS])
+
+def lexical_search(user_query: str, session_id: str, top_k: int):
+    """BM25 บน Index ของ Session คืน [(id, source, text)] (Chunk ซ้ำถูกยุบเป็น Chunk ต้นฉบับ, ข้อความอ่านจาก chunk_store)"""
+    lexical = lexical_index.get_index(session_id)
+    if lexical is None:
+        return []
+    duplicates = dedup_index.get_index(session_id)
+    ranked = []
+    for doc_id, _ in lexical.search(user_query, top_k):
+        if duplicates is not None:
+            doc_id = duplicates.canonical(doc_id)
+        if doc_id not in ranked and doc_id in lexical:
+            ranked.append(doc_id)
+    found = chunk_store.get_chunks(session_id, ranked)
+    return [(doc_id, *found[doc_id]) for doc_id in ranked if doc_id in found]
+
+def duplicate_note(session_id: str, doc_id: str) -> str:
+    """ข้อความต่อท้ายหัว Chunk เช่น " (also in: a.py, b.py)" ถ้า Chunk นี้มีตัวซ้ำในไฟล์อื่น"""
+    duplicates = dedup_index.get_index(session_id)
+    others = duplicates.duplicate_sources(doc_id) if duplicates is not None else []
+    if not others:
+        return ""
+    more = f", +{len(others) - DUPLICATE_SOURCES_SHOWN} more" if len(others) > DUPLICATE_SOURCES_SHOWN else ""
+    return f" (also in: {', '.join(others[:DUPLICATE_SOURCES_SHOWN])}{more})"
+
+def session_scopes(session_id: str):
+    """{scope: repo_id} ของทุก Repo ใน Session (Session ที่ยังไม่มีรายการ Repo ใช้ session_id ตรงๆ แบบเดิม)"""
+    repos = session_state.list_repos(session_id)
+    return {entry["scope"]: name for name, entry in repos.items()} or {session_id: None}
+
+async def search_repo(user_query: str, scope: str):
+    """ค้น Index ในเครื่องของ Repo เดียว: BM25 + Symbol Index พร้อมกัน"""
+    return await asyncio.gather(
+        run_blocking(lexical_search, user_query, scope, RETRIEVAL_TOP_K),
+        run_blocking(lookup_definitions, user_query, scope)
+    )
+
+async def retrieve_context(user_query: str, session_id: str, question_vector=None):
+    """Embed คำถามแล้วค้นหา Chunk ของทุก Repo ใน Session นี้ คืน (context_text, sources)"""
+    # 1. Embed คำถาม (ผ่าน Cache)
+    if question_vector is None:
+        question_vector = await embed_query(user_query)
+
+    # 2. ค้นหาแบบมี Filter (สำคัญมาก! 🔥) คู่กับ BM25 (จับชื่อ Identifier ตรงๆ) และ Symbol Index
+    #    Vector ค้นครั้งเดียวทั้ง Session (Filter ด้วย session_id จริง ไม่ต้องพึ่งรายการ Repo ในเครื่อง)
+    #    BM25 / Symbol Index เป็นไฟล์ในเครื่องแยกตาม scope ของแต่ละ Repo
+    repos = await run_blocking(session_state.list_repos, session_id)
+    scopes = {entry["scope"]: name for name, entry in repos.items()} or {session_id: None}
+    search_results, *results = await asyncio.gather(
+        run_blocking(
+            index.query,
+            vector=question_vector,
+            top_k=RETRIEVAL_TOP_K, 
             include_metadata=True,
-            filter={"session_id": request.session_id} 
+            filter=session_state.vector_filter(session_id, repos)
+        ),
+        *(search_repo(user_query, scope) for scope in scopes)
+    )
+
+    # 3. รวมผลทุก Repo: Cosine เทียบข้าม Repo ได้ตรงๆ (Vector Store เรียงรวมให้แล้ว)
+    #    ส่วนคะแนน BM25 ต่าง Index เทียบกันไม่ได้ รวมด้วย RRF ก่อน แล้วค่อย Fusion สองทางเหมือนเดิม
+    scope_of_repo = {name: scope for scope, name in scopes.items() if name}
+    matches = [match for match in search_results.matches if match.score > 0.40]
+    multi_repo = len(scopes) > 1 or len({match.metadata.get('repo_id') for match in matches}) > 1
+
+    def label(repo, source):
+        # หลาย Repo: ใส่ชื่อ Repo นำหน้า Path ให้รู้ว่าไฟล์มาจากไหน
+        return f"{repo}:{source}" if multi_repo and repo else source
+
+    chunks = {}  # doc_id -> (source, text, scope)
+    vector_hits = []
+    lexical_rankings = []
+    definitions = []
+    match_scopes = {}
+    for match in matches:
+        repo = match.metadata.get('repo_id')
+        match_scopes[match.id] = scope_of_repo.get(repo) or session_state.scope_of(session_id, repo)
+    # Vector Store ในเครื่องไม่เก็บ text ใน Metadata: อ่านจาก chunk_store ของ Repo นั้นแทน
+    missing = {match.id: match_scopes[match.id] for match in matches if not match.metadata.get('text')}
+    texts = await asyncio.gather(*(
+        run_blocking(chunk_store.get_chunks, scope, [doc_id for doc_id, s in missing.items() if s == scope])
+        for scope in set(missing.values())
+    ))
+    stored = {doc_id: text for found in texts for doc_id, (_, text) in found.items()}
+    for match in matches:
+        repo = match.metadata.get('repo_id')
+        text = match.metadata.get('text') or stored.get(match.id)
+        if text is None:
+            continue
+        chunks[match.id] = (label(repo, match.metadata.get('source')), text, match_scopes[match.id])
+        vector_hits.append((match.score, match.id))
+    for (scope, repo), (lexical_hits, repo_definitions) in zip(scopes.items(), results):
+        ranking = []
+        for doc_id, source, text in lexical_hits:
+            chunks.setdefault(doc_id, (label(repo, source), text, scope))
+            ranking.append(doc_id)
+        lexical_rankings.append(ranking)
+        definitions.extend({**entry, 'source': label(repo, entry['source'])} for entry in repo_definitions)
+    vector_ranking = [doc_id for _, doc_id in sorted(vector_hits, reverse=True)[:RETRIEVAL_TOP_K]]
+    lexical_ranking = lexical_index.reciprocal_rank_fusion(lexical_rankings)[:RETRIEVAL_TOP_K]
+
+    context_text = ""
+    found_sources = []
+    for entry in definitions[:SYMBOL_MAX_DEFINITIONS]:
+        context_text += (
+            f"\n--- Definition: {entry['qualname']} ({entry['kind']}) "
+            f"File: {entry['source']} lines {entry['start']}-{entry['end']} ---\n{entry['code']}\n"
         )
+        found_sources.append(entry['source'])
+    top_ids = lexical_index.reciprocal_rank_fusion([vector_ranking, lexical_ranking])[:RETRIEVAL_TOP_K]
+    # ตาราง Chunk ซ้ำอยู่บน Disk -> อ่านนอก Event Loop
+    notes = await asyncio.gather(*(run_blocking(duplicate_note, chunks[doc_id][2], doc_id) for doc_id in top_ids))
+    for doc_id, note in zip(top_ids, notes):
+        source, text, _ = chunks[doc_id]
+        context_text += f"\n--- File: {source}{note} ---\n{text}\n"
+        found_sources.append(source)
 
-        context_text = ""
-        found_sources = []
-        for match in search_results.matches:
-            if match.score > 0.40:
-                context_text += f"\n--- File: {match.metadata.get('source')} ---\n{match.metadata.get('text')}\n"
-                found_sources.append(match.metadata.get('source'))
+    if not context_text:
+        context_text = "No relevant code found in this session context."
 
-        if not context_text:
-            context_text = "No relevant code found in this session context."
+    return context_text, list(set(found_sources))
 
-        # Persona Logic
-        role_prompt = "You are a Senior Developer. Answer based on the Code Context below."
-        if user_query.lower().startswith("/refactor"): role_prompt = "You are a Clean Code Expert."
-        elif user_query.lower().startswith("/test"): role_prompt = "You are a QA Engineer."
-        elif user_query.lower().startswith("/explain"): role_prompt = "You are a Teacher."
+def build_prompt(user_query: str, context_text: str):
+    # Persona Logic
+    role_prompt = "You are a Senior Developer. Answer based on the Code Context below."
+    if user_query.lower().startswith("/refactor"): role_prompt = "You are a Clean Code Expert."
+    elif user_query.lower().startswith("/test"): role_prompt = "You are a QA Engineer."
+    elif user_query.lower().startswith("/explain"): role_prompt = "You are a Teacher."
 
-        prompt = f"""
+    return f"""
         {role_prompt}
         
         User Question: {user_query}
@@ -111,14 +363,73 @@ async def ask_codebase(request: ChatRequest):
         
         Answer (Be concise, use Markdown):
         """
+
+@app.post("/ask-codebase")
+async def ask_codebase(request: ChatRequest):
+    try:
+        if not client or not index:
+             raise HTTPException(status_code=500, detail="AI Services not initialized")
+
+        user_query = request.question.strip()
+        cached, version, question_vector = await lookup_answer(user_query, request.session_id)
+        if cached:
+            return {**cached, "cached": True}
+
+        context_text, sources = await retrieve_context(user_query, request.session_id, question_vector)
+        prompt = build_prompt(user_query, context_text)
         
-        response = client.models.generate_content(
+        response = await client.aio.models.generate_content(
             model="gemini-2.5-flash",
             contents=prompt
         )
         
-        return {"answer": response.text, "sources": list(set(found_sources))}
+        answer_cache.put(request.session_id, version, user_query, response.text, sources, question_vector)
+        return {"answer": response.text, "sources": sources}
 
     except Exception as e:
         print(f"Chat Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/ask-codebase/stream")
+async def ask_codebase_stream(request: ChatRequest):
+    """เหมือน /ask-codebase แต่ส่งแบบ Server-Sent Events: sources ก่อน แล้วตามด้วย token ทีละชิ้น"""
+    if not client or not index:
+        raise HTTPException(status_code=500, detail="AI Services not initialized")
+
+    user_query = request.question.strip()
+
+    async def event_stream():
+        try:
+            cached, version, question_vector = await lookup_answer(user_query, request.session_id)
+            if cached:
+                yield sse_event("sources", cached["sources"])
+                yield sse_event("token", cached["answer"])
+                yield sse_event("done", {"cached": True})
+                return
+
+            context_text, sources = await retrieve_context(user_query, request.session_id, question_vector)
+            yield sse_event("sources", sources)
+
+            stream = await client.aio.models.generate_content_stream(
+                model="gemini-2.5-flash",
+                contents=build_prompt(user_query, context_text)
+            )
+            answer = []
+            async for chunk in stream:
+                if chunk.text:
+                    answer.append(chunk.text)
+                    yield sse_event("token", chunk.text)
+            answer_cache.put(request.session_id, version, user_query, "".join(answer), sources, question_vector)
+            yield sse_event("done", {})
+        except Exception as e:
+            print(f"Chat Stream Error: {e}")
+            yield sse_event("error", str(e))
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
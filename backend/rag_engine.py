@@ -2,20 +2,60 @@ import os
 import shutil
 import git
 import time
+import itertools
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 from dotenv import load_dotenv
 from pinecone import Pinecone, ServerlessSpec
 from google import genai
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
+from jobs import NullProgress
+import session_state
+import embedding_cache
+import lexical_index
+import chunk_store
+import storage
+import symbol_index
+import dedup_index
+import chunking
+import git_mirror
+import file_filter
+import vector_store
+from vector_store import PINECONE_INDEX_NAME
+from concurrency import QueueWorkers, TokenBucket, bounded_map, call_with_retry, error_status
 
 # 1. โหลด Environment Variables
 load_dotenv()
 
 # 2. Config ค่าต่างๆ
-REPO_PATH = "./temp_repo"
+# แต่ละ Ingest จะ Clone ลงโฟลเดอร์ชั่วคราวของตัวเองใต้ WORKSPACE_ROOT (ตั้งเป็น /dev/shm เพื่อใช้ tmpfs ได้)
+WORKSPACE_ROOT = os.environ.get("INGEST_WORKSPACE_ROOT") or tempfile.gettempdir()
+WORKSPACE_PREFIX = "ingest_"
+WORKSPACE_STALE_SECONDS = 6 * 60 * 60
 EMBEDDING_MODEL = "text-embedding-004"
-PINECONE_INDEX_NAME = "codebase"
 BATCH_SIZE = 100 
+# Embedding แบบขนาน: จำนวน Request ที่ส่งพร้อมกัน + Quota ต่อนาทีของ API Key (ใช้ร่วมกันทุก Job ใน Process)
+EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", "4"))
+EMBED_REQUESTS_PER_MINUTE = float(os.environ.get("EMBED_REQUESTS_PER_MINUTE", "1500"))
+EMBED_MAX_RETRIES = int(os.environ.get("EMBED_MAX_RETRIES", "5"))
+# Upsert ทำขนานไปกับ Embed: จำนวน Worker + Batch ที่รอ Upsert ได้สูงสุด (กัน Memory โตเมื่อ Upsert ช้ากว่า Embed)
+UPSERT_CONCURRENCY = int(os.environ.get("UPSERT_CONCURRENCY", "4"))
+UPSERT_QUEUE_SIZE = int(os.environ.get("UPSERT_QUEUE_SIZE", "8"))
+UPSERT_MAX_RETRIES = int(os.environ.get("UPSERT_MAX_RETRIES", "5"))
+# Chunk ที่ Embed ไม่ผ่านจะเข้าคิวถาวรของ Session และลองใหม่ได้สูงสุดกี่รอบก่อนทิ้ง
+FAILED_CHUNK_MAX_ATTEMPTS = int(os.environ.get("FAILED_CHUNK_MAX_ATTEMPTS", "3"))
+# อ่าน + ตัด Chunk ขนานบน Process Pool (ast / Regex เป็นงาน CPU ล้วน ติด GIL ถ้าใช้ Thread)
+# ค่าเริ่มต้นนับเฉพาะ CPU ที่ Process นี้ใช้ได้ (ไม่ใช่ทั้งเครื่อง) และไม่เกิน SPLIT_PROCESSES_MAX
+# เพราะ Worker แต่ละตัวกิน RAM ~45 MB (Instance 512 MB รับได้ไม่กี่ตัว)
+SPLIT_PROCESSES_MAX = int(os.environ.get("SPLIT_PROCESSES_MAX", "2"))
+_usable_cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+SPLIT_PROCESSES = int(os.environ.get("SPLIT_PROCESSES", str(min(_usable_cpus, SPLIT_PROCESSES_MAX))))
+SPLIT_FILES_PER_TASK = int(os.environ.get("SPLIT_FILES_PER_TASK", "64"))
+embed_limiter = TokenBucket(rate=EMBED_REQUESTS_PER_MINUTE / 60.0, capacity=EMBED_CONCURRENCY)
 
 # 3. เริ่มต้น Pinecone
 api_key = os.environ.get("PINECONE_API_KEY")
@@ -28,8 +68,8 @@ pc = None
 index = None
 client = None
 
-# พยายาม Init ถ้ามี Key อยู่แล้ว
-if api_key:
+# พยายาม Init ถ้ามี Key อยู่แล้ว (เฉพาะตอนใช้ Pinecone เป็น Vector Store)
+if api_key and vector_store.VECTOR_BACKEND == "pinecone":
     pc = Pinecone(api_key=api_key)
     if PINECONE_INDEX_NAME not in pc.list_indexes().names():
         try:
@@ -43,6 +83,9 @@ if api_key:
             print(f"Index creation skipped/failed: {e}")
     index = pc.Index(PINECONE_INDEX_NAME)
 
+_split_pool = None
+_split_pool_lock = threading.Lock()
+
 client = None
 if os.environ.get("GEMINI_API_KEY"):
     client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
@@ -53,97 +96,582 @@ def batch_iterate(lst, n):
     for i in range(0, len(lst), n):
         yield lst[i:i + n]
 
+def batch_stream(iterable, n):
+    """เหมือน batch_iterate แต่รับ Generator ได้ (ไม่ต้องรู้ความยาวล่วงหน้า)"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+@contextmanager
+def repo_workspace(session_id: str):
+    """สร้างโฟลเดอร์ชั่วคราวแยกต่อ Job และลบทิ้งเสมอเมื่อจบ (แม้จะ Error)"""
+    os.makedirs(WORKSPACE_ROOT, exist_ok=True)
+    path = tempfile.mkdtemp(prefix=f"{WORKSPACE_PREFIX}{storage.safe_id(session_id)[:40]}_", dir=WORKSPACE_ROOT)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+def cleanup_stale_workspaces():
+    """ลบ Workspace ที่ค้างจาก Process ที่ตายไปกลางคัน"""
+    if not os.path.isdir(WORKSPACE_ROOT):
+        return
+    cutoff = time.time() - WORKSPACE_STALE_SECONDS
+    for name in os.listdir(WORKSPACE_ROOT):
+        path = os.path.join(WORKSPACE_ROOT, name)
+        try:
+            if name.startswith(WORKSPACE_PREFIX) and os.path.isdir(path) and os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+def chunk_ids(session_id: str, relative_path: str, start: int, end: int):
+    return [f"{session_id}_{relative_path}_{i}" for i in range(start, end)]
+
+def delete_repo_vectors(store, session_id: str, repo_id: str, scope: str):
+    """ลบ Vector ทั้งหมดของ Repo เดียวใน Session (Repo อื่นไม่กระทบ)
+
+    Vector แยก Repo ด้วย Metadata repo_id, Session แบบเดิม (scope == session_id) Vector ยังไม่มี repo_id
+    จึงลบตาม id ของ Chunk ที่อยู่ในสถานะล่าสุดเพิ่มด้วย
+    """
+    store.delete(filter={"session_id": session_id, "repo_id": repo_id})
+    if scope != session_id:
+        return
+    state = session_state.load_state(scope) or {}
+    ids = [
+        doc_id for path, meta in state.get("files", {}).items()
+        for doc_id in chunk_ids(scope, path, 0, meta.get("chunks", 0))
+    ]
+    for batch_ids in batch_iterate(ids, 1000):
+        store.delete(ids=batch_ids, filter={"session_id": session_id})
+
+def remote_head(repo_url: str):
+    """ดึง Commit SHA ล่าสุดของ Remote แบบไม่ต้อง Clone (None ถ้าดึงไม่ได้)"""
+    try:
+        output = git.cmd.Git().ls_remote(repo_url, "HEAD")
+        return output.split()[0] if output else None
+    except Exception as e:
+        print(f"⚠️ ls-remote failed: {e}")
+        return None
+
+def tracked_blobs(repo, rev: str = "HEAD"):
+    """คืน {relative_path: blob_sha} ของทุกไฟล์ใน rev (ใช้เป็น Content Hash, อ่านจาก Tree ไม่ต้องมี Blob)"""
+    blobs = {}
+    for entry in repo.git.ls_tree("-r", "-z", rev).split("\0"):
+        if not entry:
+            continue
+        meta, path = entry.split("\t", 1)
+        _, obj_type, sha = meta.split()
+        if obj_type == "blob":
+            blobs[path] = sha
+    return blobs
+
+def prepare_mirror(repo_url: str, known_files=None, progress=None):
+    """sync Bare Mirror แบบ Blobless แล้วดึงเฉพาะ Blob ที่ผ่าน Filter และเปลี่ยนจาก known_files (ไฟล์ที่ hash เดิมไม่ถูกดึงเลย)
+
+    คืน (mirror, commit, {path: blob_sha}, FileFilter, wanted_paths)
+    """
+    progress = progress or NullProgress()
+    mirror = git_mirror.sync_mirror(repo_url)
+    commit = mirror.git.rev_parse("HEAD")
+    blobs = tracked_blobs(mirror, commit)
+    # .gitignore / .ragignore ต้องดึงมาอ่านก่อน ถึงจะรู้ว่าไฟล์ไหนไม่ต้องดึง
+    git_mirror.fetch_blobs(mirror, commit, {blobs[path] for path in file_filter.ignore_files(blobs)})
+    filter_ = file_filter.build_filter(blobs, lambda path: chunking.read_source(git_mirror.read_blob(mirror, blobs[path])))
+    known_files = known_files or {}
+    wanted = [
+        path for path, sha in blobs.items()
+        if filter_.allows(path) and known_files.get(path, {}).get("hash") != sha
+    ]
+    fetched = git_mirror.fetch_blobs(mirror, commit, {blobs[path] for path in wanted})
+    print(f"📥 {len(wanted)} files to read ({fetched} blobs fetched, {len(blobs)} files in tree)")
+    progress.update(files_in_tree=len(blobs), blobs_fetched=fetched)
+    return mirror, commit, blobs, filter_, wanted
+
+def clone_repo(repo_url: str, repo_path: str, known_files=None, progress=None):
+    """เตรียมไฟล์ของ Commit ล่าสุดลง repo_path คืน (commit, {path: blob_sha}, FileFilter, {path: ขนาด} หรือ None)
+
+    โหมด mirror: Checkout เฉพาะไฟล์ที่ prepare_mirror ดึงมา และอ่านขนาดจาก Blob (Symlink ที่ Checkout ออกมาอาจชี้ไปไฟล์ที่ไม่มี)
+    โหมด shallow: clone --depth=1 ทั้ง Tree แบบเดิม (ขนาดอ่านจาก Disk)
+    """
+    if git_mirror.CLONE_MODE == "shallow":
+        print("📥 Cloning repository (Depth=1)...")
+        repo = git.Repo.clone_from(repo_url, repo_path, depth=1)
+        blobs = tracked_blobs(repo)
+        filter_ = file_filter.build_filter(blobs, lambda path: chunking.read_source(os.path.join(repo_path, path)))
+        return repo.head.commit.hexsha, blobs, filter_, None
+
+    mirror, commit, blobs, filter_, wanted = prepare_mirror(repo_url, known_files, progress)
+    try:
+        if wanted:
+            git_mirror.sparse_checkout(mirror, commit, wanted, repo_path)
+        sizes = {path: git_mirror.blob_size(mirror, blobs[path]) for path in wanted}
+    finally:
+        mirror.close()
+    return commit, blobs, filter_, sizes
+
+class RepoSnapshot:
+    """ไฟล์ของ Commit ที่จะ Ingest: blobs = {path: blob_sha}, filter = FileFilter ของ Repo
+
+    load(path) คืนสิ่งที่ Worker ใช้อ่านไฟล์ (bytes จาก Git Object หรือ Path บน Disk), size(path) คืนขนาดเป็น bytes
+    """
+
+    def __init__(self, commit: str, blobs: dict, filter_, load, size):
+        self.commit = commit
+        self.blobs = blobs
+        self.filter = filter_
+        self.load = load
+        self.size = size
+
+@contextmanager
+def repo_snapshot(repo_url: str, session_id: str, known_files=None, progress=None):
+    """เตรียมไฟล์ของ Commit ล่าสุด yield RepoSnapshot
+
+    โหมด objects อ่านเนื้อไฟล์จาก Object Database ของ Mirror ตรงๆ (ไม่ต้อง Checkout / ลบไฟล์เลย)
+    โหมด Checkout (mirror / shallow) อ่านจาก Workspace ชั่วคราว
+    """
+    if git_mirror.CLONE_MODE == "objects":
+        mirror, commit, blobs, filter_, _ = prepare_mirror(repo_url, known_files, progress)
+        try:
+            yield RepoSnapshot(
+                commit, blobs, filter_,
+                load=lambda path: git_mirror.read_blob(mirror, blobs[path]),
+                size=lambda path: git_mirror.blob_size(mirror, blobs[path]),
+            )
+        finally:
+            mirror.close()
+        return
+    with repo_workspace(session_id) as repo_path:
+        commit, blobs, filter_, sizes = clone_repo(repo_url, repo_path, known_files, progress)
+
+        def size(path):
+            if sizes is not None and path in sizes:
+                return sizes[path]
+            return os.path.getsize(os.path.join(repo_path, path))
+
+        yield RepoSnapshot(
+            commit, blobs, filter_,
+            load=lambda path: os.path.join(repo_path, path),
+            size=size,
+        )
+
+def get_split_pool():
+    """Process Pool สำหรับอ่าน + ตัด Chunk ใช้ร่วมกันทุก Job (None ถ้าปิดด้วย SPLIT_PROCESSES <= 1)"""
+    global _split_pool
+    if SPLIT_PROCESSES <= 1:
+        return None
+    with _split_pool_lock:
+        if _split_pool is None:
+            # spawn แทน fork: Process หลักมี Thread (Job/Upsert) วิ่งอยู่ fork กลางทางเสี่ยง Lock ค้าง
+            _split_pool = ProcessPoolExecutor(max_workers=SPLIT_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+        return _split_pool
+
+def discard_split_pool(pool):
+    """ทิ้ง Pool ที่พังแล้ว (Worker ตาย เช่น โดน OOM Kill) งานถัดไปจะได้ Pool ใหม่"""
+    global _split_pool
+    with _split_pool_lock:
+        if _split_pool is pool:
+            _split_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def shutdown_split_pool():
+    global _split_pool
+    with _split_pool_lock:
+        if _split_pool is not None:
+            _split_pool.shutdown(wait=False, cancel_futures=True)
+            _split_pool = None
+
+def iter_split_tasks(snapshot: RepoSnapshot, progress, files: dict, known_files: dict):
+    """ไล่ไฟล์ตาม Tree ของ Commit แล้วจัดกลุ่มไฟล์ที่ต้อง Split ใหม่เป็นงานละ SPLIT_FILES_PER_TASK ไฟล์
+
+    ไฟล์ที่ไม่ผ่าน Filter (ignore / vendored / generated / ใหญ่เกิน) ไฟล์ที่อ่านขนาดไม่ได้ (เช่น Symlink เสีย)
+    และไฟล์ที่ hash ตรงกับ known_files (จาก Ingest ครั้งก่อน) จะถูกข้ามตรงนี้เลย
+    """
+    task = []
+    for relative_path in sorted(snapshot.blobs):
+        # รองรับไฟล์หลายประเภท + ไม่เอาไฟล์ที่ไม่มีใครถามถึง
+        reason = snapshot.filter.path_reason(relative_path)
+        if reason:
+            if reason != "extension":
+                snapshot.filter.record(reason)
+            continue
+
+        previous = known_files.get(relative_path)
+        if previous and previous.get("hash") == snapshot.blobs[relative_path]:
+            # ไฟล์ไม่เปลี่ยน ไม่ต้อง Split/Embed ใหม่
+            files[relative_path] = previous
+            progress.incr("files_unchanged")
+            continue
+
+        try:
+            size = snapshot.size(relative_path)
+        except OSError:
+            snapshot.filter.record("unreadable")
+            continue
+        if size > file_filter.size_limit(relative_path):
+            snapshot.filter.record("size", size)
+            continue
+
+        task.append((relative_path, snapshot.load(relative_path)))
+        if len(task) >= SPLIT_FILES_PER_TASK:
+            yield task
+            task = []
+    if task:
+        yield task
+
+def iter_documents(snapshot: RepoSnapshot, session_id: str, progress, files: dict, known_files=None, symbols=None,
+                   texts=None):
+    """Generator: เดินไฟล์ -> อ่าน -> ตัด Chunk (ไม่เก็บทั้ง Repo ไว้ใน Memory)
+
+    อ่าน + ตัด Chunk กระจายไปหลาย Process (งานละหลายไฟล์) แต่ yield Chunk ตามลำดับไฟล์เดิม
+    ระหว่างทางจะเติม files = {path: {"hash", "chunks"}} ของทุกไฟล์ที่อยู่ใน Index
+    และอัปเดต symbols (SymbolIndex) ของไฟล์ที่อ่านใหม่ (โค้ดของ Definition เขียนลง texts = ChunkStore)
+    """
+    tasks = iter_split_tasks(snapshot, progress, files, known_files or {})
+    pool = get_split_pool()
+    if pool:
+        # งานค้างใน Pool ไม่เกิน 2 เท่าของจำนวน Process (พอให้ทุก Core ไม่ว่าง แต่ไม่อ่านล่วงหน้าทั้ง Repo)
+        results = bounded_map(chunking.chunk_files, tasks, SPLIT_PROCESSES * 2, executor=pool)
+    else:
+        results = ((task, chunking.chunk_files(task), None) for task in tasks)
+
+    for task, processed, error in results:
+        if isinstance(error, BrokenProcessPool):
+            # Pool พังกลางทาง: ทิ้ง Pool (Ingest ครั้งหน้าสร้างใหม่) แล้วตัด Chunk งานที่เหลือใน Process นี้แทน
+            if pool is not None:
+                print(f"⚠️ Split pool broken ({error}), chunking in-process")
+                discard_split_pool(pool)
+                pool = None
+            processed, error = chunking.chunk_files(task), None
+        if error:
+            raise error
+        for relative_path, chunks, entries, skipped in processed:
+            if skipped:
+                # ไฟล์ Binary / Minified / Generated ที่ดูจากเนื้อไฟล์ (หรืออ่านไม่ได้)
+                snapshot.filter.record(*skipped)
+                continue
+            if symbols is not None:
+                entries, codes = symbol_index.split_code(entries)
+                symbols.add_entries(relative_path, entries)
+                if texts is not None:
+                    texts.put_definitions(relative_path, codes)
+
+            files[relative_path] = {"hash": snapshot.blobs.get(relative_path), "chunks": len(chunks)}
+            progress.incr("files_processed")
+            progress.incr("chunks_total", len(chunks))
+            for i, text in enumerate(chunks):
+                yield {
+                    # ✅ ใส่ session_id ใน ID เพื่อความ Unique
+                    "id": f"{session_id}_{relative_path}_{i}", 
+                    "text": text,
+                    "source": relative_path
+                }
+
+def embed_texts(client, texts, cache=None):
+    """Embed ข้อความ โดยเช็ค Cache ก่อน แล้วส่งเฉพาะตัวที่ไม่เจอไปที่ Gemini
+
+    คืน (vectors, cache_hits)
+    """
+    vectors = cache.get_many(EMBEDDING_MODEL, texts) if cache else [None] * len(texts)
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    if missing:
+        missing_texts = [texts[i] for i in missing]
+        embeddings = call_with_retry(
+            client.models.embed_content,
+            model=EMBEDDING_MODEL, 
+            contents=missing_texts,
+            retries=EMBED_MAX_RETRIES,
+            limiter=embed_limiter
+        )
+        new_vectors = [e.values for e in embeddings.embeddings]
+        for i, values in zip(missing, new_vectors):
+            vectors[i] = values
+        if cache:
+            cache.put_many(EMBEDDING_MODEL, missing_texts, new_vectors)
+    return vectors, len(texts) - len(missing)
+
+def is_payload_too_large(error):
+    status = error_status(error)
+    message = str(error).lower()
+    return status == 413 or (status == 400 and any(
+        k in message for k in ("too large", "payload", "exceed", "too many", "limit")
+    ))
+
+def embed_adaptive(client, texts, cache=None):
+    """embed_texts ที่แบ่ง Batch ครึ่งหนึ่งไปเรื่อยๆ เมื่อ Request ใหญ่เกิน
+
+    คืน (vectors, cache_hits) โดย vectors[i] = None ถ้า Chunk เดี่ยวนั้นยังใหญ่เกินอยู่ดี
+    """
+    try:
+        return embed_texts(client, texts, cache)
+    except Exception as e:
+        if not is_payload_too_large(e):
+            raise
+        if len(texts) == 1:
+            print(f"⚠️ Skipping oversized chunk ({len(texts[0])} chars): {e}")
+            return [None], 0
+        mid = len(texts) // 2
+        left, left_hits = embed_adaptive(client, texts[:mid], cache)
+        right, right_hits = embed_adaptive(client, texts[mid:], cache)
+        return left + right, left_hits + right_hits
+
 # ✅ ปรับแก้ฟังก์ชันรับ session_id
-def ingest_repo(repo_url: str, session_id: str):
-    """โหลด Repo โดยผูกติดกับ Session ID"""
-    print(f"🚀 Starting ingestion for Session: {session_id}")
+def ingest_repo(repo_url: str, session_id: str, progress=None, incremental: bool = False):
+    """โหลด Repo เข้า Session (progress = IngestJob สำหรับรายงานสถานะ)
+
+    Session หนึ่งมีได้หลาย Repo: ข้อมูลของแต่ละ Repo แยกกันด้วย scope (ดู session_state.repo_scope)
+    การ Ingest Repo นี้ไม่ลบ / ไม่แก้ข้อมูลของ Repo อื่นใน Session
+    incremental=True: ใช้สถานะจาก Ingest ครั้งก่อน Embed เฉพาะไฟล์ที่เปลี่ยน และลบ Vector ของไฟล์ที่ถูกลบ
+    """
+    progress = progress or NullProgress()
+    scope = session_state.repo_scope(session_id, repo_url)
+    repo_id = session_state.repo_id(repo_url)
+    print(f"🚀 Starting ingestion for Session: {session_id} (repo scope: {scope})")
+
+    previous = session_state.load_state(scope) if incremental else None
+    if previous and storage.normalize_url(previous.get("repo_url") or "") != storage.normalize_url(repo_url):
+        previous = None
+
+    # Chunk ที่ค้างจากรอบก่อน (Embed ไม่ผ่าน) จะถูกลองใหม่ในรอบนี้
+    pending_failed = session_state.load_failed(scope) if previous else []
+
+    # 0. Commit ไม่เปลี่ยนเลย และไม่มีอะไรค้าง -> ไม่ต้องทำอะไร
+    if previous and not pending_failed and previous.get("commit") and remote_head(repo_url) == previous["commit"]:
+        print(f"✅ Session {session_id} is already at {previous['commit'][:8]}, nothing to do")
+        return {
+            "status": "unchanged", "chunks": 0, "session_id": session_id,
+            "repo_id": repo_id, "commit": previous["commit"],
+        }
     
     # Re-init clients if needed (in case globals are None)
-    local_pc = Pinecone(api_key=os.environ.get("PINECONE_API_KEY"))
-    local_index = local_pc.Index(PINECONE_INDEX_NAME)
+    local_index = vector_store.get_store()
+    if local_index is None:
+        raise RuntimeError("Vector store not configured (set PINECONE_API_KEY or VECTOR_BACKEND=local)")
     local_client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
 
     # 1. ลบความจำเก่า *เฉพาะของ Session นี้* ทิ้ง (Session อื่นไม่กระทบ)
+    if not previous:
+        try:
+            print(f"🧹 Clearing old memory for session: {session_id}...")
+            # 🔥 Feature เด็ด: ลบเฉพาะข้อมูลของ Repo นี้ใน Session นี้ (Repo อื่นไม่กระทบ)
+            delete_repo_vectors(local_index, session_id, repo_id, scope)
+            session_state.clear_state(scope)
+            lexical_index.delete_index(scope)
+            chunk_store.delete_store(scope)
+            symbol_index.delete_index(scope)
+            dedup_index.delete_index(scope)
+            time.sleep(2)
+        except Exception as e:
+            print(f"⚠️ Note: Clean up failed (maybe empty): {e}")
+
+    # 2. Clone -> เดินไฟล์ -> Split -> Embed -> Upsert แบบ Streaming
+    #    Memory ใช้แค่ระดับ Batch: Embed ค้างได้ไม่เกิน EMBED_CONCURRENCY, รอ Upsert ไม่เกิน UPSERT_QUEUE_SIZE
+    known_files = previous["files"] if previous else {}
+    files = {}
+    # BM25 Index สร้างจาก Chunk ชุดเดียวกัน (ไม่ต้องรอ/พึ่ง Embedding)
+    lexical = lexical_index.load_index(scope) if previous else lexical_index.LexicalIndex()
+    # เนื้อหา Chunk เขียนลง Disk ทันที (BM25 Index ถือแค่ Posting ไม่ถือข้อความ)
+    texts = chunk_store.ChunkStore(scope)
     try:
-        print(f"🧹 Clearing old memory for session: {session_id}...")
-        # 🔥 Feature เด็ด: ลบเฉพาะข้อมูลที่ติดป้าย session_id นี้
-        local_index.delete(filter={"session_id": session_id})
-        time.sleep(2)
-    except Exception as e:
-        print(f"⚠️ Note: Clean up failed (maybe empty): {e}")
+        # ตาราง Definition ของ Function/Class (ดึงจากเนื้อไฟล์ตอนอ่าน ไม่ต้องรอ Embedding เช่นกัน)
+        symbols = symbol_index.load_index(scope) if previous else symbol_index.SymbolIndex()
+        # Chunk ที่ซ้ำ (เป๊ะ / เกือบเหมือน) กับ Chunk ที่มีอยู่แล้ว ไม่ต้อง Embed / Upsert ซ้ำ
+        dedup = dedup_index.load_index(scope) if previous else dedup_index.DedupIndex()
+        cache = embedding_cache.get_cache()
+        counts = {"chunks": 0, "embedded": 0, "failed": 0, "skipped": 0, "duplicates": 0}
+        failed_docs = []
+        replaced_ids = []  # Chunk ที่เคยมี Vector แต่รอบนี้กลายเป็นตัวซ้ำ (ต้องลบ Vector เดิม)
 
-    # 2. Clone Repo
-    if os.path.exists(REPO_PATH):
-        shutil.rmtree(REPO_PATH)
+        def unique_documents(documents):
+            """ส่งต่อเฉพาะ Chunk ต้นฉบับไป Embed ส่วนตัวที่ซ้ำเก็บแค่ Reference (และยังอยู่ใน BM25 เหมือนเดิม)"""
+            for doc in documents:
+                if dedup.check(doc['id'], doc['text'], doc['source']) is None:
+                    yield doc
+                    continue
+                counts["duplicates"] += 1
+                progress.incr("chunks_duplicate")
+                lexical.add(doc['id'], doc['text'])
+                texts.put(doc['id'], doc['source'], doc['text'])
+                if doc['source'] in known_files:
+                    replaced_ids.append(doc['id'])
 
-    print("📥 Cloning repository (Depth=1)...")
-    git.Repo.clone_from(repo_url, REPO_PATH, depth=1)
+        def embed_batch(batch_docs):
+            return embed_adaptive(local_client, [doc['text'] for doc in batch_docs], cache)
 
-    documents = []
-    print("📂 Processing files...")
-    
-    for root, dirs, files in os.walk(REPO_PATH):
-        if '.git' in dirs: dirs.remove('.git')
-        if 'node_modules' in dirs: dirs.remove('node_modules')
-        
-        for file in files:
-            file_path = os.path.join(root, file)
-            # รองรับไฟล์หลายประเภท
-            if file.endswith(('.py', '.js', '.jsx', '.ts', '.tsx', '.md', '.txt', '.html', '.css', '.java', '.cs', '.go', '.php')):
-                try:
-                    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read()
-                        
-                    relative_path = os.path.relpath(file_path, REPO_PATH)
-                    
-                    splitter = RecursiveCharacterTextSplitter(
-                        chunk_size=1000, 
-                        chunk_overlap=200,
-                        separators=["\n\n", "\n", " ", ""]
-                    )
-
-                    chunks_data = splitter.create_documents([content])
-                    
-                    for i, chunk in enumerate(chunks_data):
-                        documents.append({
-                            # ✅ ใส่ session_id ใน ID เพื่อความ Unique
-                            "id": f"{session_id}_{relative_path}_{i}", 
-                            "text": chunk.page_content,
-                            "source": relative_path
-                        })
-                except Exception:
-                    pass
-
-    # 3. Embed & Upsert
-    print(f"🧠 Embedding {len(documents)} chunks...")
-    vectors_to_upsert = []
-    
-    for i, batch_docs in enumerate(batch_iterate(documents, BATCH_SIZE)):
-        texts = [doc['text'] for doc in batch_docs]
-        try:
-            embeddings = local_client.models.embed_content(
-                model=EMBEDDING_MODEL, 
-                contents=texts
-            )
-            
-            for doc, embedding in zip(batch_docs, embeddings.embeddings):
-                vectors_to_upsert.append({
+        def upsert_batch(batch_vec):
+            call_with_retry(local_index.upsert, vectors=batch_vec, retries=UPSERT_MAX_RETRIES)
+            progress.incr("vectors_upserted", len(batch_vec))
+
+        def handle_embedded(batch_docs, embedded, error):
+            """ส่ง Chunk ที่ Embed สำเร็จไป Upsert ส่วนที่ล้มเหลวเก็บเข้าคิว (ไม่ทิ้งเงียบๆ)"""
+            if error:
+                print(f"❌ Error embedding batch ({len(batch_docs)} chunks), queued for retry: {error}")
+                for doc in batch_docs:
+                    failed_docs.append({**doc, "attempts": doc.get("attempts", 0) + 1})
+                return
+            vectors, cache_hits = embedded
+            progress.incr("embedding_cache_hits", cache_hits)
+            batch_vec = []
+            for doc, values in zip(batch_docs, vectors):
+                if values is None:
+                    counts["skipped"] += 1
+                    continue
+                batch_vec.append({
                     "id": doc['id'],
-                    "values": embedding.values,
+                    "values": values,
                     "metadata": {
                         "text": doc['text'], 
                         "source": doc['source'],
-                        "session_id": session_id 
+                        "session_id": session_id,  # Query ทั้ง Session ได้โดยไม่ต้องรู้รายการ Repo
+                        "repo_id": repo_id  # แยก Repo ใน Session (ลบ / จำกัดการค้นหาทีละ Repo)
                     }
                 })
-        except Exception as e:
-            print(f"❌ Error embedding batch: {e}")
+            counts["embedded"] += len(batch_vec)
+            progress.update(chunks_embedded=counts["embedded"], chunks_skipped=counts["skipped"])
+            if batch_vec:
+                upserter.put(batch_vec)
 
-    print(f"☁️ Uploading vectors...")
-    for batch_vec in batch_iterate(vectors_to_upsert, BATCH_SIZE):
-        local_index.upsert(vectors=batch_vec)
+        progress.set_phase("clone")
+        with repo_snapshot(repo_url, scope, known_files, progress) as snapshot:
+            commit = snapshot.commit
 
-    if os.path.exists(REPO_PATH):
-        shutil.rmtree(REPO_PATH)
+            # ไฟล์ที่ต้องอ่านใหม่ (เปลี่ยน / ถูกลบ / ถูก Filter) เอาออกจากตาราง Chunk ซ้ำก่อน
+            # Chunk ซ้ำในไฟล์อื่นที่ต้นฉบับหายไปด้วย ถูกตรวจใหม่ก่อนไฟล์อื่น (เนื้อหาเอาจาก chunk_store ไม่ต้องอ่านไฟล์)
+            reused = {
+                path for path, meta in known_files.items()
+                if snapshot.filter.allows(path) and snapshot.blobs.get(path) == meta.get("hash")
+            }
+            orphan_ids = [doc_id for doc_id, _ in dedup.remove_sources(set(known_files) - reused)]
+            orphans = [
+                {"id": doc_id, "text": text, "source": source}
+                for doc_id, (source, text) in sorted(texts.get_many(orphan_ids).items())
+            ]
+
+            print("📂 Processing files (streaming)...")
+            progress.set_phase("split")
+            documents = unique_documents(itertools.chain(
+                orphans, iter_documents(snapshot, scope, progress, files, known_files, symbols, texts)
+            ))
+            # Upsert Batch k ระหว่างที่ Batch k+1 กำลัง Embed
+            upserter = QueueWorkers(upsert_batch, workers=UPSERT_CONCURRENCY, maxsize=UPSERT_QUEUE_SIZE, name="upsert")
+            try:
+                # ส่งหลาย Batch พร้อมกัน (จำกัดด้วย EMBED_CONCURRENCY + Token Bucket) แต่รับผลตามลำดับเดิม
+                for batch_docs, embedded, error in bounded_map(embed_batch, batch_stream(documents, BATCH_SIZE), EMBED_CONCURRENCY):
+                    if counts["chunks"] == 0:
+                        # Batch แรกกลับมาแล้ว -> จากนี้คอขวดอยู่ที่ Embed
+                        progress.set_phase("embed")
+                    counts["chunks"] += len(batch_docs)
+                    for doc in batch_docs:
+                        lexical.add(doc['id'], doc['text'])
+                        texts.put(doc['id'], doc['source'], doc['text'])
+                    handle_embedded(batch_docs, embedded, error)
+
+                # 2.1 ลองใหม่อีกรอบสำหรับ Chunk ที่ล้มเหลว (ทั้งรอบนี้และที่ค้างจากรอบก่อน)
+                #     ตัดตัวที่ไฟล์ถูกลบหรือเปลี่ยนไปแล้วทิ้ง เพราะถูก Split ใหม่ในรอบนี้แล้ว
+                for doc in failed_docs:
+                    doc["hash"] = files.get(doc["source"], {}).get("hash")
+                retry_docs = failed_docs + [
+                    doc for doc in pending_failed
+                    if doc["source"] in files and files[doc["source"]].get("hash") == doc.get("hash")
+                ]
+                failed_docs = []
+                if retry_docs:
+                    print(f"🔁 Retrying {len(retry_docs)} failed chunks...")
+                    for batch_docs, embedded, error in bounded_map(embed_batch, batch_iterate(retry_docs, BATCH_SIZE), EMBED_CONCURRENCY):
+                        handle_embedded(batch_docs, embedded, error)
+                progress.set_phase("upsert")
+            finally:
+                upserter.close()
+
+            filtered = snapshot.filter.report()
+            if filtered["files"]:
+                summary = ", ".join(f"{reason}={count}" for reason, count in sorted(filtered["files"].items()))
+                print(f"🚫 Skipped {sum(filtered['files'].values())} files ({summary}), {filtered['total_bytes'] / 1e6:.1f} MB not read")
+            progress.update(files_filtered=sum(filtered["files"].values()), bytes_filtered=filtered["total_bytes"])
+            if counts["duplicates"]:
+                print(f"♻️ {counts['duplicates']} duplicate chunks stored as references (not embedded)")
+
+        # 2.2 Chunk ที่ยังล้มเหลว: เก็บลงคิวถาวรไว้ลองใหม่รอบหน้า (จนกว่าจะครบ FAILED_CHUNK_MAX_ATTEMPTS)
+        still_failed = []
+        for doc in failed_docs:
+            if doc["attempts"] >= FAILED_CHUNK_MAX_ATTEMPTS:
+                counts["skipped"] += 1
+            else:
+                still_failed.append(doc)
+        counts["failed"] = len(still_failed)
+        session_state.save_failed(scope, still_failed)
+        progress.update(chunks_failed=counts["failed"], chunks_skipped=counts["skipped"])
+
+        # 3. Incremental: ลบ Vector ของไฟล์ที่หายไป และ Chunk ส่วนเกินของไฟล์ที่สั้นลง
+        stale_ids = []
+        for path, old in known_files.items():
+            new_count = files[path]["chunks"] if path in files else 0
+            stale_ids.extend(chunk_ids(scope, path, new_count, old.get("chunks", 0)))
+        if stale_ids:
+            print(f"🧹 Removing {len(stale_ids)} stale vectors...")
+            for batch_ids in batch_iterate(stale_ids, 1000):
+                local_index.delete(ids=batch_ids, filter={"session_id": session_id})
+            progress.update(vectors_deleted=len(stale_ids))
+        if replaced_ids:
+            for batch_ids in batch_iterate(replaced_ids, 1000):
+                local_index.delete(ids=batch_ids, filter={"session_id": session_id})
+        lexical.remove(stale_ids)
+        texts.delete(stale_ids)
+        removed_files = [path for path in known_files if path not in files]
+        for path in removed_files:
+            symbols.remove_file(path)
+        texts.delete_definitions(removed_files)
+    finally:
+        texts.close()
+
+    local_index.flush()
+    lexical_index.save_index(scope, lexical)
+    symbol_index.save_index(scope, symbols)
+    dedup_index.save_index(scope, dedup)
+    session_state.save_state(scope, repo_url, commit, files)
+    session_state.add_repo(session_id, repo_url, scope)
         
-    return {"status": "success", "chunks": len(documents), "session_id": session_id}
\ No newline at end of file
+    return {
+        "status": "success" if not (counts["failed"] or counts["skipped"]) else "partial",
+        "chunks": counts["chunks"],
+        "embedded": counts["embedded"],
+        "failed": counts["failed"],
+        "skipped": counts["skipped"],
+        "duplicates": counts["duplicates"],
+        "session_id": session_id,
+        "repo_id": repo_id,
+        "commit": commit,
+        "incremental": bool(previous),
+        "files_changed": sum(1 for path, meta in files.items() if known_files.get(path) != meta),
+        "files_removed": sum(1 for path in known_files if path not in files),
+        "symbols": len(symbols),
+        "filtered": filtered,
+    }
+
+def remove_repo(session_id: str, repo_id: str):
+    """ลบ Repo หนึ่งออกจาก Session (Vector, BM25, Symbol, ตาราง Chunk ซ้ำ, สถานะ) Repo อื่นไม่กระทบ
+
+    คืน entry ของ Repo ที่ลบ หรือ None ถ้าไม่มี Repo นี้ใน Session
+    """
+    local_index = vector_store.get_store()
+    if local_index is None:
+        raise RuntimeError("Vector store not configured (set PINECONE_API_KEY or VECTOR_BACKEND=local)")
+    # เอาออกจากรายการก่อน: การค้นหาจะไม่เห็น Repo นี้ตั้งแต่ตอนนี้ แม้จะลบข้อมูลยังไม่เสร็จ
+    entry = session_state.remove_repo(session_id, repo_id)
+    if entry is None:
+        return None
+    scope = entry["scope"]
+    print(f"🧹 Removing repo {repo_id} from session {session_id}...")
+    delete_repo_vectors(local_index, session_id, repo_id, scope)
+    local_index.flush()
+    lexical_index.delete_index(scope)
+    chunk_store.delete_store(scope)
+    symbol_index.delete_index(scope)
+    dedup_index.delete_index(scope)
+    session_state.clear_state(scope)
+    return entry
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import storage
+
+# เก็บสถานะการ Ingest ล่าสุดของแต่ละ Session (commit SHA + hash ของแต่ละไฟล์)
+STATE_DIR = os.environ.get("INGEST_STATE_DIR", "./ingest_state")
+
+_lock = threading.Lock()
+_repos_lock = threading.Lock()  # อ่าน-แก้-เขียน รายการ Repo ของ Session
+
+
+def _state_path(session_id: str, suffix: str = "") -> str:
+    return os.path.join(STATE_DIR, f"{storage.safe_id(session_id)}{suffix}.json")
+
+
+def _write_json(path: str, data):
+    with _lock:
+        os.makedirs(STATE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+
+def load_state(session_id: str):
+    """คืน dict สถานะล่าสุดของ Session หรือ None ถ้ายังไม่เคย Ingest"""
+    path = _state_path(session_id)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(session_id: str, repo_url: str, commit: str, files: dict):
+    """บันทึกสถานะแบบ Atomic (เขียนไฟล์ชั่วคราวแล้ว rename ทับ)"""
+    state = {
+        "session_id": session_id,
+        "repo_url": repo_url,
+        "commit": commit,
+        "files": files,
+        "updated_at": time.time(),
+    }
+    _write_json(_state_path(session_id), state)
+    return state
+
+
+def corpus_version(session_id: str):
+    """เวอร์ชันของข้อมูลที่ Ingest ไว้ทั้ง Session (mtime ล่าสุดของรายการ Repo และไฟล์สถานะของทุก Repo)
+    เปลี่ยนทุกครั้งที่ Ingest / เพิ่ม / ลบ Repo เสร็จ, None ถ้าไม่มี
+    """
+    paths = [_state_path(session_id, ".repos")] + [_state_path(scope) for scope in repo_scopes(session_id)]
+    versions = []
+    for path in paths:
+        try:
+            versions.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            pass
+    return max(versions, default=None)
+
+
+# --- Repo หลายตัวใน Session เดียว ---
+# แต่ละ Repo มี scope ของตัวเอง (ใช้แทน session_id เป็น Key ของ Vector / BM25 / Symbol / สถานะ)
+# จึง Ingest / ลบทีละ Repo ได้โดยไม่กระทบ Repo อื่นใน Session
+
+
+def repo_id(repo_url: str) -> str:
+    """ชื่อสั้นของ Repo จาก URL + Hash สั้นของ URL เต็ม เช่น https://github.com/org/service.git -> org-service-1a2b3c
+
+    Hash กัน Repo ชื่อเดียวกันคนละ Host / คนละ Org ชนกัน (URL รูปอื่นของ Repo เดียวกันได้ id เดิม)
+    """
+    url = storage.normalize_url(repo_url)
+    parts = [p for p in url.split("/") if p][-2:]
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", "-".join(parts)) or "repo"
+    return f"{name}-{hashlib.sha1(url.encode('utf-8')).hexdigest()[:6]}"
+
+
+def _find_repo(repos: dict, repo_url: str):
+    """(repo_id, entry) ของ Repo ที่ URL ชี้ Repo เดียวกัน (รวม entry เก่าที่ใช้ repo_id แบบเดิม) หรือ (None, None)"""
+    url = storage.normalize_url(repo_url)
+    for name, entry in repos.items():
+        if storage.normalize_url(entry["repo_url"]) == url:
+            return name, entry
+    return None, None
+
+
+def list_repos(session_id: str):
+    """{repo_id: {"repo_url", "scope", "added_at"}} ของ Session
+
+    Session แบบเดิม (Repo เดียว ไม่มีรายการ Repo) ใช้ session_id เป็น scope ของ Repo นั้น
+    """
+    try:
+        with open(_state_path(session_id, ".repos"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+    state = load_state(session_id)
+    if state and state.get("repo_url"):
+        return {repo_id(state["repo_url"]): {"repo_url": state["repo_url"], "scope": session_id, "added_at": state.get("updated_at")}}
+    return {}
+
+
+def repo_scopes(session_id: str):
+    return [entry["scope"] for entry in list_repos(session_id).values()]
+
+
+def repo_scope(session_id: str, repo_url: str) -> str:
+    """scope ของ Repo นี้ใน Session (ของเดิมถ้าเคย Ingest แล้ว ไม่งั้นสร้างใหม่)
+
+    เทียบด้วย normalize_url: x, x.git, x/ และ ssh / https ของ Repo เดียวกันได้ scope เดิม
+    """
+    _, entry = _find_repo(list_repos(session_id), repo_url)
+    if entry:
+        return entry["scope"]
+    return scope_of(session_id, repo_id(repo_url))
+
+
+def scope_of(session_id: str, name: str) -> str:
+    """scope มาตรฐานของ repo_id ใน Session (ใช้เดา scope ของ Vector เมื่อไม่มีรายการ Repo ในเครื่อง)"""
+    return f"{session_id}--{name}" if name else session_id
+
+
+def vector_filter(session_id: str, repos=None):
+    """Filter ของ Vector ทั้ง Session: Metadata session_id คือ Session จริง ส่วน Repo แยกด้วย repo_id
+
+    ไม่พึ่งรายการ Repo ในเครื่อง (หายได้ตอน Restart / คนละ Instance) ถ้ามีรายการก็จำกัดเฉพาะ Repo ในรายการ
+    ยกเว้น Session แบบเดิมที่ Vector ยังไม่มี repo_id (scope == session_id)
+    """
+    if repos and all(entry["scope"] != session_id for entry in repos.values()):
+        return {"session_id": session_id, "repo_id": {"$in": sorted(repos)}}
+    return {"session_id": session_id}
+
+
+def add_repo(session_id: str, repo_url: str, scope: str):
+    """บันทึก Repo ลงรายการของ Session (เรียกหลัง Ingest เสร็จ)"""
+    with _repos_lock:
+        repos = list_repos(session_id)
+        # entry เดิมของ Repo นี้ (URL คนละรูป หรือ repo_id แบบเก่า) ถูกแทนที่ด้วย repo_id ปัจจุบัน
+        previous, _ = _find_repo(repos, repo_url)
+        if previous is not None:
+            del repos[previous]
+        repos[repo_id(repo_url)] = {"repo_url": repo_url, "scope": scope, "added_at": time.time()}
+        _write_json(_state_path(session_id, ".repos"), repos)
+
+
+def remove_repo(session_id: str, name: str):
+    """เอา Repo ออกจากรายการของ Session คืน entry เดิม (None ถ้าไม่มี)"""
+    with _repos_lock:
+        repos = list_repos(session_id)
+        entry = repos.pop(name, None)
+        if entry is not None:
+            _write_json(_state_path(session_id, ".repos"), repos)
+        return entry
+
+
+def load_failed(session_id: str):
+    """คิว Chunk ที่ Embed ไม่สำเร็จ (แต่ละตัวมี id, text, source, hash, attempts)"""
+    try:
+        with open(_state_path(session_id, ".failed"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def save_failed(session_id: str, docs):
+    if docs:
+        _write_json(_state_path(session_id, ".failed"), docs)
+    else:
+        _remove(_state_path(session_id, ".failed"))
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def clear_state(session_id: str):
+    _remove(_state_path(session_id))
+    _remove(_state_path(session_id, ".failed"))
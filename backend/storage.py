@@ -0,0 +1,81 @@
+import os
+import pickle
+import re
+import threading
+
+from lru import LRUCache
+
+
+def safe_id(value: str) -> str:
+    """แปลง session_id / scope เป็นชื่อไฟล์ที่ปลอดภัย (เหลือแค่ตัวอักษร ตัวเลข - _)"""
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in value)
+
+
+_SCP_URL = re.compile(r"^[\w.-]+@([\w.-]+):(?!//)/*(.*)$")  # git@github.com:org/x
+_NETWORK_URL = re.compile(r"^(?:https?|ssh|git)://(?:[^@/]+@)?([^/:]+)(?::\d+)?/+(.*)$", re.I)
+
+
+def normalize_url(repo_url: str) -> str:
+    """รูปเดียวของ URL ที่ชี้ Repo เดียวกัน ใช้เทียบ / เป็น Key (ไม่ใช้ Clone)
+
+    ตัด .git และ / ท้าย, ssh (git@host:org/x) กับ https ได้ host/org/x เหมือนกัน, file:// ได้ Path ตรงๆ
+    """
+    url = repo_url.strip().rstrip("/")
+    url = re.sub(r"\.git$", "", url).rstrip("/")
+    match = _SCP_URL.match(url) or _NETWORK_URL.match(url)
+    if match:
+        return f"{match.group(1).lower()}/{match.group(2)}"
+    return re.sub(r"^file://", "", url)
+
+
+class PickleStore:
+    """เก็บ Index ต่อ Session เป็น Pickle หนึ่งไฟล์ (ใช้ร่วมกันโดย lexical_index / symbol_index / dedup_index)
+
+    factory: สร้าง Index ว่างเมื่อยังไม่มีไฟล์
+    """
+
+    def __init__(self, directory: str, factory, cache_size: int = 64):
+        self.directory = directory
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._loaded = LRUCache(maxsize=cache_size)  # session_id -> (mtime, Index) สำหรับฝั่ง Query
+
+    def path(self, session_id: str) -> str:
+        return os.path.join(self.directory, f"{safe_id(session_id)}.pickle")
+
+    def load(self, session_id: str):
+        """โหลด Index จาก Disk (คืน Index ว่างถ้ายังไม่มี)"""
+        try:
+            with open(self.path(session_id), "rb") as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return self.factory()
+
+    def save(self, session_id: str, index):
+        path = self.path(session_id)
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+
+    def delete(self, session_id: str):
+        try:
+            os.remove(self.path(session_id))
+        except OSError:
+            pass
+        self._loaded.pop(session_id)
+
+    def get(self, session_id: str):
+        """Index สำหรับตอบคำถาม: Cache ไว้ใน Memory และโหลดใหม่เมื่อไฟล์เปลี่ยน (None ถ้าไม่มี)"""
+        try:
+            mtime = os.stat(self.path(session_id)).st_mtime_ns
+        except OSError:
+            return None
+        cached = self._loaded.get(session_id)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        index = self.load(session_id)
+        self._loaded.put(session_id, (mtime, index))
+        return index
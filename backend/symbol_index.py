@@ -0,0 +1,283 @@
+import ast
+import bisect
+import os
+import re
+
+import storage
+
+# ตาราง Symbol (function / class / method) ต่อ Session สร้างตอน Ingest ใช้หา Definition ตามชื่อแบบ O(1)
+SYMBOL_INDEX_DIR = os.environ.get("SYMBOL_INDEX_DIR", "./ingest_state/symbols")
+# ตัดโค้ดของ Definition ที่ยาวมากๆ (เช่น Class ทั้งก้อน) ไม่ให้ล้น Prompt
+SYMBOL_SNIPPET_MAX_CHARS = int(os.environ.get("SYMBOL_SNIPPET_MAX_CHARS", "4000"))
+# จำนวน Index ที่ถือไว้ใน Memory ฝั่ง Query พร้อมกัน
+SYMBOL_CACHE_SIZE = int(os.environ.get("SYMBOL_CACHE_SIZE", "8"))
+
+# คำที่ Regex ของภาษาตระกูลปีกกาจับได้เหมือนชื่อ Method แต่ไม่ใช่
+_CONTROL_WORDS = frozenset((
+    "if", "for", "foreach", "while", "switch", "catch", "return", "new", "else", "do", "try",
+    "using", "lock", "fixed", "typeof", "sizeof", "function", "constructor",
+))
+
+_BRACE_PATTERNS = {
+    "js": [
+        ("function", re.compile(r"^[ \t]*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*([A-Za-z_$][\w$]*)", re.M)),
+        ("class", re.compile(r"^[ \t]*(?:export\s+)?(?:default\s+)?(?:abstract\s+)?class\s+([A-Za-z_$][\w$]*)", re.M)),
+        ("class", re.compile(r"^[ \t]*(?:export\s+)?(?:interface|enum)\s+([A-Za-z_$][\w$]*)", re.M)),
+        ("function", re.compile(
+            r"^[ \t]*(?:export\s+)?(?:const|let|var)\s+([A-Za-z_$][\w$]*)\s*(?::[^=]+)?=\s*"
+            r"(?:async\s+)?(?:function\b|\([^()]*\)\s*(?::[^=]+)?=>|[A-Za-z_$][\w$]*\s*=>)", re.M)),
+        ("method", re.compile(
+            r"^[ \t]+(?:(?:public|private|protected|static|async|readonly|override|get|set)\s+)*"
+            r"([A-Za-z_$][\w$]*)\s*\([^()]*\)\s*(?::\s*[^{;]+)?\{", re.M)),
+    ],
+    "java": [
+        ("class", re.compile(
+            r"^[ \t]*(?:(?:public|private|protected|internal|static|abstract|final|sealed|partial)\s+)*"
+            r"(?:class|interface|enum|record|struct)\s+([A-Za-z_]\w*)", re.M)),
+        ("method", re.compile(
+            r"^[ \t]*(?:(?:public|private|protected|internal|static|final|abstract|async|override|virtual|"
+            r"synchronized|sealed|extern|unsafe|new)\s+)*[\w<>\[\],.?]+\s+([A-Za-z_]\w*)\s*\([^;{}]*\)\s*"
+            r"(?:throws\s+[\w.,\s]+)?(?:where\s+[^{]+)?\{", re.M)),
+    ],
+    "go": [
+        ("function", re.compile(r"^func\s+([A-Za-z_]\w*)\s*[\[(]", re.M)),
+        ("method", re.compile(r"^func\s*\(\s*\w*\s*\*?\s*([A-Za-z_]\w*)[^)]*\)\s*([A-Za-z_]\w*)\s*\(", re.M)),
+        ("class", re.compile(r"^type\s+([A-Za-z_]\w*)\s+(?:struct|interface)\b", re.M)),
+    ],
+    "php": [
+        ("class", re.compile(r"^[ \t]*(?:(?:abstract|final)\s+)?(?:class|interface|trait|enum)\s+([A-Za-z_]\w*)", re.M)),
+        ("function", re.compile(
+            r"^[ \t]*(?:(?:public|private|protected|static|abstract|final)\s+)*function\s+&?\s*([A-Za-z_]\w*)", re.M)),
+    ],
+}
+
+_NEWLINE = re.compile("\n")
+
+LANGUAGE_BY_EXTENSION = {
+    ".py": "python",
+    ".js": "js", ".jsx": "js", ".ts": "js", ".tsx": "js",
+    ".java": "java", ".cs": "java",
+    ".go": "go",
+    ".php": "php",
+}
+
+
+def line_offsets(text: str):
+    """ตำแหน่งเริ่มของแต่ละบรรทัด + len(text) ปิดท้าย (บรรทัด i = text[offsets[i]:offsets[i + 1]])"""
+    offsets = [0]
+    offsets.extend(m.end() for m in _NEWLINE.finditer(text))
+    if offsets[-1] != len(text):
+        offsets.append(len(text))
+    return offsets
+
+
+def _python_symbols(text: str):
+    # ast.parse คือต้นทุนหลักของการตัด Chunk ไฟล์ที่ไม่มี def/class ไม่ต้อง Parse
+    # (ไม่จำกัดขนาด: ไฟล์ถูกจำกัดที่ file_filter.MAX_FILE_BYTES อยู่แล้ว และ Parse ใน Process Pool)
+    if "def " not in text and "class " not in text:
+        return []
+    try:
+        tree = ast.parse(text)
+    except (SyntaxError, ValueError):
+        return []
+    symbols = []
+
+    def visit(nodes, parent):
+        for node in nodes:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                is_class = isinstance(node, ast.ClassDef)
+                start = min([node.lineno] + [d.lineno for d in node.decorator_list])
+                symbols.append({
+                    "name": node.name,
+                    "qualname": f"{parent}.{node.name}" if parent else node.name,
+                    "kind": "class" if is_class else ("method" if parent else "function"),
+                    "start": start,
+                    "end": node.end_lineno or node.lineno,
+                })
+                # ลงไปเก็บ Method / Nested Class แต่ไม่เก็บ Function ที่ซ้อนใน Function
+                if is_class:
+                    visit(node.body, symbols[-1]["qualname"])
+
+    visit(tree.body, "")
+    return symbols
+
+
+def _block_end(text: str, pos: int) -> int:
+    """หาตำแหน่งปีกกาปิดของ Block แรกหลัง pos (ข้าม String/Comment) หรือ ; ถ้าเจอก่อน (ไม่มี Body)"""
+    depth = 0
+    i, n = pos, len(text)
+    while i < n:
+        c = text[i]
+        if c in "\"'`":
+            i += 1
+            while i < n and text[i] != c:
+                i += 2 if text[i] == "\\" else 1
+        elif text.startswith("//", i):
+            i = text.find("\n", i)
+            if i < 0:
+                return n - 1
+        elif text.startswith("/*", i):
+            i = text.find("*/", i + 2)
+            if i < 0:
+                return n - 1
+            i += 1
+        elif c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth <= 0:
+                return i
+        elif c == ";" and depth == 0:
+            return i
+        i += 1
+    return n - 1
+
+
+def _brace_symbols(text: str, language: str):
+    line_starts = line_offsets(text)
+
+    def line_of(offset):
+        return bisect.bisect_right(line_starts, offset)
+
+    symbols = []
+    seen = set()
+    for kind, pattern in _BRACE_PATTERNS[language]:
+        for match in pattern.finditer(text):
+            if language == "go" and kind == "method":
+                receiver, name = match.group(1), match.group(2)
+            else:
+                receiver, name = None, match.group(1)
+            if name in _CONTROL_WORDS:
+                continue
+            name_pos = match.start(1 if receiver is None else 2)
+            start = line_of(name_pos)
+            if start in seen:
+                continue
+            seen.add(start)
+            if match.group(0).endswith("=>") and not text[match.end():].lstrip(" \t").startswith("{"):
+                # Arrow Function แบบ Expression (ไม่มีปีกกา) นับแค่บรรทัดเดียว
+                end = start
+            else:
+                end = line_of(_block_end(text, name_pos))
+            symbols.append({
+                "name": name,
+                "qualname": f"{receiver}.{name}" if receiver else name,
+                "kind": kind,
+                "start": start,
+                "end": end,
+            })
+
+    # Method ที่อยู่ใน Class: ตั้ง qualname เป็น Class.method ตาม Class ที่ครอบอยู่ชั้นในสุด
+    classes = sorted((s for s in symbols if s["kind"] == "class"), key=lambda s: s["end"] - s["start"])
+    for symbol in symbols:
+        if symbol["qualname"] != symbol["name"]:
+            continue
+        for cls in classes:
+            if cls is not symbol and cls["start"] < symbol["start"] and symbol["end"] <= cls["end"]:
+                symbol["qualname"] = f"{cls['name']}.{symbol['name']}"
+                if symbol["kind"] == "function":
+                    symbol["kind"] = "method"
+                break
+    # Regex method จับได้แต่ไม่อยู่ใน Class ถือว่าไม่ใช่ Definition (เช่น if (...) { ใน Function)
+    symbols = [s for s in symbols if s["kind"] != "method" or "." in s["qualname"]]
+    return sorted(symbols, key=lambda s: s["start"])
+
+
+def extract_symbols(path: str, text: str):
+    """ดึง Definition จากไฟล์ คืน [{name, qualname, kind, start, end}] (บรรทัดเริ่มที่ 1, end รวมบรรทัดสุดท้าย)
+
+    .py ใช้ ast, ภาษาตระกูลปีกกาใช้ Regex + นับปีกกา, ไฟล์อื่นคืน []
+    """
+    language = LANGUAGE_BY_EXTENSION.get(os.path.splitext(path)[1].lower())
+    if language == "python":
+        return _python_symbols(text)
+    if language:
+        return _brace_symbols(text, language)
+    return []
+
+
+def symbol_entries(source: str, text: str, symbols=None):
+    """Definition ของไฟล์ + โค้ดของแต่ละตัว (code ถูกแยกไปเก็บใน chunk_store ก่อนใส่ลง SymbolIndex ดู split_code)"""
+    if symbols is None:
+        symbols = extract_symbols(source, text)
+    offsets = line_offsets(text) if symbols else None
+    entries = []
+    for symbol in symbols:
+        start = offsets[symbol["start"] - 1]
+        code = text[start:min(offsets[symbol["end"]], start + SYMBOL_SNIPPET_MAX_CHARS)].rstrip("\n")
+        entries.append({**symbol, "source": source, "code": code})
+    return entries
+
+
+def split_code(entries):
+    """แยกโค้ดออกจาก entries: คืน (entries ที่เหลือแค่ชื่อ + ตำแหน่ง, [(บรรทัดเริ่ม, code)])
+
+    Index ที่ถูก Cache ไว้ฝั่ง Query จึงไม่ถือโค้ด (Class ยังซ้ำโค้ดของ Method ข้างใน) โค้ดอ่านจาก chunk_store ตอนใช้
+    """
+    codes = [(entry["start"], entry["code"]) for entry in entries if "code" in entry]
+    return [{key: value for key, value in entry.items() if key != "code"} for entry in entries], codes
+
+
+class SymbolIndex:
+    """Hash Map ชื่อ -> Definition (ค้นได้ทั้งชื่อสั้น เช่น ingest_repo และ qualname เช่น JobManager.submit)"""
+
+    def __init__(self):
+        self.files = {}  # source -> [entry]
+        self.names = {}  # name / qualname -> [entry]
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.files.values())
+
+    def add_file(self, source: str, text: str, symbols=None):
+        """แทนที่ Symbol ทั้งหมดของไฟล์ด้วยที่ดึงจาก text ใหม่ (symbols = ผลของ extract_symbols ถ้ามีแล้ว)"""
+        self.add_entries(source, split_code(symbol_entries(source, text, symbols))[0])
+
+    def add_entries(self, source: str, entries):
+        """แทนที่ Symbol ทั้งหมดของไฟล์ด้วย entries ที่สร้างไว้แล้ว (เช่น จาก Worker Process)"""
+        self.remove_file(source)
+        for entry in entries:
+            for key in {entry["name"], entry["qualname"]}:
+                self.names.setdefault(key, []).append(entry)
+        if entries:
+            self.files[source] = entries
+
+    def remove_file(self, source: str):
+        for entry in self.files.pop(source, []):
+            for key in {entry["name"], entry["qualname"]}:
+                bucket = self.names.get(key)
+                if bucket is None:
+                    continue
+                bucket[:] = [e for e in bucket if e is not entry]
+                if not bucket:
+                    del self.names[key]
+
+    def lookup(self, name: str):
+        """คืน Definition ทั้งหมดที่ชื่อ (หรือ qualname) ตรงกันแบบ Case-sensitive"""
+        return self.names.get(name, [])
+
+
+# --- Persistence (ใช้ storage.PickleStore ร่วมกับ lexical_index / dedup_index) ---
+_store = storage.PickleStore(SYMBOL_INDEX_DIR, SymbolIndex, SYMBOL_CACHE_SIZE)
+load_index = _store.load
+save_index = _store.save
+delete_index = _store.delete
+get_index = _store.get  # Index สำหรับฝั่ง Query (None ถ้าไม่มี)
+
+
+_QUESTION_IDENTIFIER = re.compile(r"`([^`]+)`|([A-Za-z_$][\w$]*(?:\.[A-Za-z_$][\w$]*)*)(\s*\()?")
+
+
+def _looks_like_code(name: str) -> bool:
+    """ชื่อในคำถามที่น่าจะเป็น Identifier (มี _ / . / ตัวเลข / camelCase) ไม่ใช่คำธรรมดา"""
+    return "_" in name or "." in name or any(c.isdigit() for c in name) or any(c.isupper() for c in name[1:])
+
+
+def symbols_in_question(question: str):
+    """ดึงชื่อที่ควรลองหาใน SymbolIndex: ใน `backticks`, ตามด้วย ( หรือหน้าตาเหมือน Identifier"""
+    names = []
+    for match in _QUESTION_IDENTIFIER.finditer(question):
+        quoted, word, call = match.groups()
+        name = (quoted or "").strip().rstrip("()") or word
+        if name and (quoted or call or _looks_like_code(name)) and name not in names:
+            names.append(name)
+    return names
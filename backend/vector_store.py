@@ -0,0 +1,527 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+
+import numpy as np
+from pinecone import Pinecone
+
+import storage
+from lru import LRUCache
+
+# เลือก Vector Store: "pinecone" (ค่าเดิม) หรือ "local" (รันในเครื่อง ไม่ต้องต่อ Service ภายนอก)
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "pinecone").lower()
+PINECONE_INDEX_NAME = "codebase"
+LOCAL_INDEX_DIR = os.environ.get("LOCAL_INDEX_DIR", "./vector_index")
+# Session ที่มี Vector เกินนี้จะใช้ HNSW (ถ้าติดตั้ง hnswlib) แทน Brute-force
+LOCAL_HNSW_THRESHOLD = int(os.environ.get("LOCAL_HNSW_THRESHOLD", "50000"))
+DIMENSION = 768
+# เก็บ Vector ในเครื่องเป็น float32 หรือ float16 (ประหยัด Memory ครึ่งหนึ่ง)
+LOCAL_INDEX_DTYPE = np.dtype(os.environ.get("LOCAL_INDEX_DTYPE", "float32"))
+SCORE_BLOCK_ROWS = 1024
+# "int8": เก็บ Vector แบบ Quantize ไว้ใน RAM (เล็กกว่า float32 ~4 เท่า) ค้นหาคร่าวๆ แล้ว Re-rank
+# ผู้สมัคร k * LOCAL_RERANK_FACTOR ตัวด้วย Vector เต็มความละเอียดที่อยู่ในไฟล์ mmap
+LOCAL_INDEX_QUANTIZATION = os.environ.get("LOCAL_INDEX_QUANTIZATION", "none").lower()
+LOCAL_RERANK_FACTOR = int(os.environ.get("LOCAL_RERANK_FACTOR", "8"))
+# จำนวน Index (Session, Repo) ที่ไม่มีการเขียนค้างซึ่งถือไว้ใน Memory พร้อมกัน (ตัวที่ยังไม่ flush ไม่นับ ไม่ถูกไล่ออก)
+LOCAL_SESSION_CACHE_SIZE = int(os.environ.get("LOCAL_SESSION_CACHE_SIZE", "16"))
+
+try:
+    import hnswlib
+except ImportError:  # hnswlib เป็น Optional
+    hnswlib = None
+
+
+class Match:
+    """ผลลัพธ์หนึ่งรายการ หน้าตาเหมือน Match ของ Pinecone (id, score, metadata)"""
+
+    __slots__ = ("id", "score", "metadata")
+
+    def __init__(self, id, score, metadata):
+        self.id = id
+        self.score = score
+        self.metadata = metadata
+
+
+class QueryResult:
+    def __init__(self, matches):
+        self.matches = matches
+
+
+class VectorStore:
+    """Interface กลางที่ rag_engine/main ใช้ (ชื่อ Method/Argument เหมือน Pinecone Index)"""
+
+    def upsert(self, vectors):
+        raise NotImplementedError
+
+    def delete(self, ids=None, filter=None):
+        raise NotImplementedError
+
+    def query(self, vector, top_k: int = 5, include_metadata: bool = True, filter=None):
+        raise NotImplementedError
+
+    def flush(self):
+        """บันทึกการเปลี่ยนแปลงลง Storage (Backend ที่เขียนทันทีอยู่แล้วไม่ต้องทำอะไร)"""
+
+
+class PineconeStore(VectorStore):
+    def __init__(self, index):
+        self.index = index
+
+    def upsert(self, vectors):
+        return self.index.upsert(vectors=vectors)
+
+    def delete(self, ids=None, filter=None):
+        # Pinecone ลบด้วย ids ได้โดยตรง (filter ใช้เฉพาะตอนลบทั้ง Session)
+        if ids is not None:
+            return self.index.delete(ids=ids)
+        return self.index.delete(filter=filter)
+
+    def query(self, vector, top_k: int = 5, include_metadata: bool = True, filter=None):
+        return self.index.query(vector=vector, top_k=top_k, include_metadata=include_metadata, filter=filter)
+
+
+def _session_of(filter):
+    if not filter or "session_id" not in filter:
+        raise ValueError("Local vector store requires a session_id filter")
+    return _value_of(filter["session_id"])
+
+
+def _value_of(condition):
+    # รองรับทั้ง {"key": "x"} และ {"key": {"$eq": "x"}}
+    return condition["$eq"] if isinstance(condition, dict) else condition
+
+
+def _repos_of(filter):
+    """repo_id ที่ Filter ต้องการ (set) หรือ None = ทุก Repo ใน Session (รองรับ "x", {"$eq": "x"}, {"$in": [...]})"""
+    condition = filter.get("repo_id")
+    if condition is None:
+        return None
+    if isinstance(condition, dict) and "$in" in condition:
+        return set(condition["$in"])
+    return {_value_of(condition)}
+
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def quantize_int8(matrix):
+    """Symmetric int8 ต่อแถว: row ≈ codes * scale คืน (codes int8, scales float32)"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.rint(matrix / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def blockwise_scores(matrix, query, scales=None):
+    """matrix @ query ทีละช่วงในรูป float32 (numpy ไม่มี BLAS ของ float16/int8)"""
+    if matrix.dtype == np.float32 and scales is None:
+        return matrix @ query
+    out = np.empty(matrix.shape[0], dtype=np.float32)
+    for start in range(0, matrix.shape[0], SCORE_BLOCK_ROWS):
+        end = start + SCORE_BLOCK_ROWS
+        out[start:end] = matrix[start:end].astype(np.float32) @ query
+    if scales is not None:
+        out *= scales
+    return out
+
+
+def top_k_rows(scores, k: int):
+    # argpartition หา Top-k แบบ O(n) แล้วค่อยเรียงแค่ k ตัว
+    top = np.argpartition(-scores, k - 1)[:k] if k < scores.shape[0] else np.arange(scores.shape[0])
+    return top[np.argsort(-scores[top])]
+
+
+class SessionIndex:
+    """Vector ของ Session เดียว: Matrix ที่ Normalize แล้ว (cosine = dot product) + Metadata
+
+    Matrix จองพื้นที่ล่วงหน้าแล้วขยายทีละ 2 เท่า (ไม่ต้อง Copy ทุก Batch) และ Filter ของ Session
+    คือตัว Matrix เอง จึงค้นได้ด้วย Dot Product ครั้งเดียว + argpartition
+    บันทึกเป็น vectors-*.npy (เปิดแบบ mmap ตอนโหลด) และ meta.json ในโฟลเดอร์ของ Session
+    """
+
+    def __init__(self, path: str, dtype=LOCAL_INDEX_DTYPE, quantization: str = LOCAL_INDEX_QUANTIZATION):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.quantization = quantization
+        self.ids = []
+        self.metadata = []
+        self._row_of = {}
+        self._matrix = np.zeros((0, DIMENSION), dtype=self.dtype)
+        self.hnsw = None
+        self.codes = None
+        self.scales = None
+        self.dirty = False
+        self.version = 0  # เพิ่มทุกครั้งที่ข้อมูลเปลี่ยน (กราฟ HNSW ที่สร้างจากข้อมูลเก่าจะไม่ถูกใช้)
+        self.loaded_mtime = None
+        self.lock = threading.RLock()
+        self._load()
+
+    @property
+    def vectors(self):
+        return self._matrix[:len(self.ids)]
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.path, "meta.json")
+
+    def _mtime(self):
+        try:
+            return os.stat(self.meta_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load(self):
+        mtime = self._mtime()
+        if mtime is None:
+            return
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        vectors = np.load(os.path.join(self.path, meta["vectors_file"]), mmap_mode="r")
+        if vectors.shape[0] != len(meta["ids"]):
+            raise ValueError(f"Corrupted local index at {self.path}")
+        self.ids = meta["ids"]
+        self.metadata = meta["metadata"]
+        self._row_of = {vid: i for i, vid in enumerate(self.ids)}
+        self._matrix = vectors
+        self._invalidate()
+        self.version += 1
+        graph_path = _graph_path(os.path.join(self.path, meta["vectors_file"]))
+        if hnswlib is not None and os.path.exists(graph_path):
+            self.hnsw = _load_hnsw(graph_path, vectors.shape[1], len(self.ids))
+        if self.quantization == "int8" and meta.get("quant_file"):
+            # Vector เต็มอยู่ใน mmap (ไม่กิน RAM ถ้าไม่ถูกอ่าน) ส่วน int8 โหลดขึ้น RAM ทั้งหมด
+            with np.load(os.path.join(self.path, meta["quant_file"])) as quant:
+                self.codes, self.scales = quant["codes"], quant["scales"]
+        self.loaded_mtime = mtime
+
+    def _invalidate(self):
+        self.hnsw = None
+        self.codes = None
+        self.scales = None
+
+    def refresh(self):
+        """โหลดใหม่ถ้า Process อื่นเขียนทับไฟล์ไปแล้ว"""
+        with self.lock:
+            if not self.dirty and self._mtime() != self.loaded_mtime:
+                self._load()
+
+    def _reserve(self, rows: int, dim: int):
+        """ให้ Matrix เขียนได้และมีที่ว่างพอสำหรับ rows แถว"""
+        matrix = self._matrix
+        if matrix.shape[1] != dim and not self.ids:
+            matrix = np.zeros((0, dim), dtype=self.dtype)
+        if matrix.flags.writeable and matrix.shape[0] >= rows and matrix.shape[1] == dim:
+            self._matrix = matrix
+            return
+        capacity = max(rows, 2 * matrix.shape[0], 1024)
+        grown = np.empty((capacity, dim), dtype=self.dtype)
+        count = len(self.ids)
+        grown[:count] = matrix[:count]  # ไฟล์ mmap เป็น Read-only ก็ถูก Copy ออกมาตรงนี้
+        self._matrix = grown
+
+    def upsert(self, items):
+        with self.lock:
+            values = _normalize([item["values"] for item in items])
+            new_count = sum(1 for item in items if item["id"] not in self._row_of)
+            self._reserve(len(self.ids) + new_count, values.shape[1])
+            for item, row_values in zip(items, values):
+                row = self._row_of.get(item["id"])
+                if row is None:
+                    row = len(self.ids)
+                    self._row_of[item["id"]] = row
+                    self.ids.append(item["id"])
+                    self.metadata.append(item.get("metadata", {}))
+                else:
+                    self.metadata[row] = item.get("metadata", {})
+                self._matrix[row] = row_values
+            self._invalidate()
+            self.version += 1
+            self.dirty = True
+
+    def delete(self, ids):
+        with self.lock:
+            rows = sorted((self._row_of[i] for i in set(ids) if i in self._row_of), reverse=True)
+            if not rows:
+                return
+            self._reserve(len(self.ids), self._matrix.shape[1])
+            # ย้ายแถวสุดท้ายมาแทนที่แถวที่ลบ (O(จำนวนที่ลบ) ไม่ต้องสร้าง Matrix ใหม่)
+            for row in rows:
+                last = len(self.ids) - 1
+                del self._row_of[self.ids[row]]
+                if row != last:
+                    self._matrix[row] = self._matrix[last]
+                    self.ids[row] = self.ids[last]
+                    self.metadata[row] = self.metadata[last]
+                    self._row_of[self.ids[row]] = row
+                self.ids.pop()
+                self.metadata.pop()
+            self._invalidate()
+            self.version += 1
+            self.dirty = True
+
+    def _quantized(self):
+        if self.codes is None:
+            self.codes, self.scales = quantize_int8(self.vectors)
+        return self.codes, self.scales
+
+    def memory_bytes(self):
+        """ขนาด Array ของ Vector ที่อยู่ใน RAM จริง
+
+        โหมด int8: codes + scales และ Matrix เต็มเฉพาะตอนที่ยังอยู่ใน RAM (ก่อน flush) ถ้าเปิดแบบ mmap แล้วไม่นับ
+        เพราะอ่านแค่แถวผู้สมัครตอน Re-rank, โหมดอื่น: ทั้ง Matrix (ค้นแบบ Brute-force อ่านทุกแถวทุกครั้ง)
+        """
+        if self.quantization == "int8":
+            codes, scales = self._quantized()
+            resident = codes.nbytes + scales.nbytes
+            if not isinstance(self._matrix, np.memmap):
+                resident += self._matrix.nbytes
+            return resident
+        return self._matrix.nbytes
+
+    def _hnsw_index(self):
+        """กราฟ HNSW ที่ตรงกับข้อมูลปัจจุบัน (None = ใช้ Brute-force)
+
+        ไม่สร้างกราฟตอน Query: ระหว่าง Ingest (ข้อมูลเปลี่ยนแล้วยังไม่ flush) ค้นแบบ Brute-force ไปก่อน
+        กราฟสร้างใหม่ตอน flush (นอก Lock) แล้วบันทึกไว้ข้างไฟล์ .npy
+        """
+        if len(self.ids) < LOCAL_HNSW_THRESHOLD:
+            return None
+        return self.hnsw
+
+    def query(self, vector, top_k: int):
+        with self.lock:
+            if not self.ids:
+                return []
+            query = _normalize(vector)
+            k = min(top_k, len(self.ids))
+            hnsw = self._hnsw_index()
+            if hnsw is not None:
+                labels, distances = hnsw.knn_query(query, k=k)
+                # space="ip" คืนค่า 1 - dot
+                return [(int(row), 1.0 - float(d)) for row, d in zip(labels[0], distances[0])]
+            if self.quantization == "int8":
+                codes, scales = self._quantized()
+                candidates = top_k_rows(blockwise_scores(codes, query, scales), k * LOCAL_RERANK_FACTOR)
+                # Re-rank ด้วย Vector เต็ม (อ่านเฉพาะแถวผู้สมัครจากไฟล์ mmap เรียงตามตำแหน่งในไฟล์)
+                rows = np.sort(candidates)
+                exact = np.asarray(self.vectors[rows], dtype=np.float32) @ query
+                order = np.argsort(-exact)[:k]
+                return [(int(row), float(score)) for row, score in zip(rows[order], exact[order])]
+            scores = blockwise_scores(self.vectors, query)
+            return [(int(row), float(scores[row])) for row in top_k_rows(scores, k)]
+
+    def flush(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            os.makedirs(self.path, exist_ok=True)
+            # เขียนไฟล์ Vector ชื่อใหม่ทุกครั้ง แล้วค่อยสลับ meta.json (Atomic) ให้ Reader ไม่เห็นไฟล์ครึ่งๆ
+            old_files = []
+            if os.path.exists(self.meta_path):
+                with open(self.meta_path, "r", encoding="utf-8") as f:
+                    old_meta = json.load(f)
+                old_files = [old_meta.get("vectors_file"), old_meta.get("quant_file")]
+                if old_meta.get("vectors_file"):
+                    old_files.append(os.path.basename(_graph_path(old_meta["vectors_file"])))
+            meta = {"vectors_file": f"vectors-{uuid.uuid4().hex}.npy", "ids": self.ids, "metadata": self.metadata}
+            vectors_path = os.path.join(self.path, meta["vectors_file"])
+            np.save(vectors_path, np.asarray(self.vectors, dtype=self.dtype))
+            if self.quantization == "int8":
+                codes, scales = self._quantized()
+                meta["quant_file"] = f"quant-{uuid.uuid4().hex}.npz"
+                np.savez(os.path.join(self.path, meta["quant_file"]), codes=codes, scales=scales)
+            tmp_meta = f"{self.meta_path}.tmp"
+            with open(tmp_meta, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(tmp_meta, self.meta_path)
+            for old_file in old_files:
+                if old_file:
+                    try:
+                        os.remove(os.path.join(self.path, old_file))
+                    except OSError:
+                        pass
+            # เปิดไฟล์ที่เพิ่งเขียนแบบ mmap แทน Matrix ใน RAM (ไม่งั้น Process ที่ Ingest ถือ float ทั้งก้อนค้างไว้)
+            self._matrix = np.load(vectors_path, mmap_mode="r")
+            self.dirty = False
+            self.loaded_mtime = self._mtime()
+            matrix, version = self._matrix, self.version
+
+        if hnswlib is None or matrix.shape[0] < LOCAL_HNSW_THRESHOLD:
+            return
+        # สร้างกราฟจากไฟล์ mmap ที่เพิ่งเขียน (ไม่เปลี่ยนแล้ว) นอก Lock: Query / Upsert ไม่ต้องรอ
+        graph = _build_hnsw(matrix)
+        graph.save_index(_graph_path(vectors_path))
+        with self.lock:
+            if self.version == version:
+                self.hnsw = graph
+
+
+def _graph_path(vectors_path: str) -> str:
+    return vectors_path[:-len(".npy")] + ".hnsw"
+
+
+def _build_hnsw(matrix):
+    index = hnswlib.Index(space="ip", dim=matrix.shape[1])
+    index.init_index(max_elements=matrix.shape[0], ef_construction=200, M=16)
+    for start in range(0, matrix.shape[0], SCORE_BLOCK_ROWS * 16):
+        rows = np.asarray(matrix[start:start + SCORE_BLOCK_ROWS * 16], dtype=np.float32)
+        index.add_items(rows, np.arange(start, start + rows.shape[0]))
+    index.set_ef(64)
+    return index
+
+
+def _load_hnsw(path: str, dim: int, count: int):
+    index = hnswlib.Index(space="ip", dim=dim)
+    index.load_index(path, max_elements=count)
+    index.set_ef(64)
+    return index
+
+
+def _partition_of(repo_id):
+    return storage.safe_id(repo_id) if repo_id else None
+
+
+class LocalVectorStore(VectorStore):
+    """Vector Store ในเครื่อง แยก Index ต่อ (session_id, repo_id) ตาม Metadata/Filter
+
+    โฟลเดอร์ <session>/<repo_id> ต่อ Repo, Vector แบบเดิมที่ไม่มี repo_id อยู่ที่โฟลเดอร์ <session> ตรงๆ
+    Query ของ Session ค้นทุก Repo ของ Session (หรือเฉพาะ repo_id ใน Filter) แล้วรวมผลตามคะแนน
+    Metadata ไม่เก็บ text (เนื้อหา Chunk อยู่ใน chunk_store แล้ว) และ Session ที่ไม่มีบน Disk ไม่ถูก Cache
+    """
+
+    def __init__(self, root: str = LOCAL_INDEX_DIR, dtype=LOCAL_INDEX_DTYPE,
+                 quantization: str = LOCAL_INDEX_QUANTIZATION):
+        self.root = root
+        self.dtype = dtype
+        self.quantization = quantization
+        self._sessions = LRUCache(maxsize=LOCAL_SESSION_CACHE_SIZE)  # (session, partition) -> SessionIndex
+        self._writing = {}  # Index ที่มีการเขียนรอ flush (ต้องอยู่ใน Memory จนกว่าจะ flush)
+        self._lock = threading.Lock()
+
+    def _path(self, session_id: str, partition=None):
+        path = os.path.join(self.root, storage.safe_id(session_id))
+        return os.path.join(path, partition) if partition else path
+
+    def _session(self, session_id: str, partition=None, write: bool = False):
+        """partition = ชื่อโฟลเดอร์ของ Repo (storage.safe_id ของ repo_id) หรือ None = Vector แบบเดิม
+
+        write=False (Query): คืน None ถ้ายังไม่มีบน Disk, write=True: สร้างใหม่ได้ และกันไม่ให้หลุดจาก Cache จนกว่าจะ flush
+        """
+        key = (session_id, partition)
+        with self._lock:
+            session = self._writing.get(key) or self._sessions.get(key)
+            if session is None:
+                path = self._path(session_id, partition)
+                if not write and not os.path.exists(os.path.join(path, "meta.json")):
+                    return None
+                session = SessionIndex(path, self.dtype, self.quantization)
+                self._sessions.put(key, session)
+            if write:
+                self._writing[key] = session
+        session.refresh()
+        return session
+
+    def _mark_writing(self, session_id: str, partition, session):
+        with self._lock:
+            self._writing[(session_id, partition)] = session
+
+    def _partition_keys(self, session_id: str, repos=None):
+        """partition ของทุก Repo ใน Session ที่มีอยู่ (บน Disk หรือยังไม่ flush) ตาม repos (None = ทุก Repo)"""
+        root = self._path(session_id)
+        keys = set()
+        if os.path.exists(os.path.join(root, "meta.json")):
+            keys.add(None)
+        try:
+            names = os.listdir(root)
+        except OSError:
+            names = []
+        keys.update(name for name in names if os.path.exists(os.path.join(root, name, "meta.json")))
+        with self._lock:
+            keys.update(partition for sid, partition in self._writing if sid == session_id)
+        if repos is not None:
+            keys &= {_partition_of(repo_id) for repo_id in repos}
+        return sorted(keys, key=lambda key: key or "")
+
+    def upsert(self, vectors):
+        by_partition = {}
+        for item in vectors:
+            metadata = {key: value for key, value in item["metadata"].items() if key != "text"}
+            key = (metadata["session_id"], _partition_of(metadata.get("repo_id")))
+            by_partition.setdefault(key, []).append({**item, "metadata": metadata})
+        for (session_id, partition), items in by_partition.items():
+            session = self._session(session_id, partition, write=True)
+            session.upsert(items)
+            self._mark_writing(session_id, partition, session)
+
+    def delete(self, ids=None, filter=None):
+        session_id = _session_of(filter)
+        repos = _repos_of(filter)
+        partitions = self._partition_keys(session_id, repos)
+        if ids is not None:
+            for partition in partitions:
+                session = self._session(session_id, partition, write=True)
+                session.delete(ids)
+                self._mark_writing(session_id, partition, session)
+            return
+        with self._lock:
+            for partition in partitions:
+                self._writing.pop((session_id, partition), None)
+                self._sessions.pop((session_id, partition))
+        if repos is None:
+            # ทั้ง Session
+            shutil.rmtree(self._path(session_id), ignore_errors=True)
+            return
+        for partition in {_partition_of(repo_id) for repo_id in repos}:
+            shutil.rmtree(self._path(session_id, partition), ignore_errors=True)
+
+    def query(self, vector, top_k: int = 5, include_metadata: bool = True, filter=None):
+        session_id = _session_of(filter)
+        matches = []
+        for partition in self._partition_keys(session_id, _repos_of(filter)):
+            session = self._session(session_id, partition)
+            if session is None:
+                continue
+            with session.lock:
+                matches.extend(
+                    Match(session.ids[row], score, session.metadata[row] if include_metadata else None)
+                    for row, score in session.query(vector, top_k)
+                )
+        matches.sort(key=lambda match: match.score, reverse=True)
+        return QueryResult(matches[:top_k])
+
+    def flush(self):
+        with self._lock:
+            writing = list(self._writing.items())
+        for key, session in writing:
+            session.flush()
+            with self._lock:
+                # flush แล้ว (และไม่มีใครเขียนเพิ่มระหว่างนั้น) กลับไปอยู่ใน LRU ตามปกติ
+                if not session.dirty and self._writing.get(key) is session:
+                    del self._writing[key]
+                    self._sessions.put(key, session)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Vector Store ตัวเดียวต่อ Process ตาม VECTOR_BACKEND (None ถ้าเป็น Pinecone แต่ไม่มี API Key)"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if VECTOR_BACKEND == "local":
+                _store = LocalVectorStore()
+            else:
+                api_key = os.environ.get("PINECONE_API_KEY")
+                if not api_key:
+                    return None
+                _store = PineconeStore(Pinecone(api_key=api_key).Index(PINECONE_INDEX_NAME))
+        return _store
@@ -171,11 +171,19 @@ export default function Home() {
 
     setIngestStatus("loading");
     try {
-      // ✅ 2. Send session_id to Backend
-      await axios.post(`${getApiUrl()}/ingest`, { 
+      // ✅ 2. Send session_id to Backend (ได้ job_id กลับมาทันที)
+      const submit = await axios.post(`${getApiUrl()}/ingest`, { 
           repo_url: repoUrl,
           session_id: currentSessionId // 🔥 Critical fix
       });
+
+      // ⏳ Poll สถานะ Job จนกว่าจะเสร็จ
+      let job = submit.data;
+      while (job.status === "queued" || job.status === "running") {
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+        job = (await axios.get(`${getApiUrl()}/ingest/${submit.data.job_id}`)).data;
+      }
+      if (job.status !== "done") throw new Error(job.error || "Ingest failed");
       
       setIngestStatus("success");
       
@@ -233,24 +241,46 @@ export default function Home() {
     setChatLoading(true);
 
     try {
-      // ✅ 3. Send session_id to Backend
-      const res = await axios.post(`${getApiUrl()}/ask-codebase`, { 
-          question: userMsg.content,
-          session_id: currentSessionId // 🔥 Critical fix
+      // ✅ 3. Send session_id to Backend (Stream คำตอบแบบ SSE: sources มาก่อน ตามด้วย token)
+      const res = await fetch(`${getApiUrl()}/ask-codebase/stream`, {
+          method: "POST",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify({
+              question: userMsg.content,
+              session_id: currentSessionId // 🔥 Critical fix
+          })
       });
-
-      const aiMsg: Message = { 
-        role: "ai", 
-        content: res.data.answer,
-        context: res.data.context_used || (res.data.sources ? `Sources: ${res.data.sources.join(", ")}` : undefined),
-        timestamp: Date.now()
-      };
-
-      const finalSessions = updatedWithUser.map(s => 
-        s.id === currentSessionId ? { ...s, messages: [...s.messages, aiMsg] } : s
-      );
-      saveSessions(finalSessions);
-
+      if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
+
+      const aiMsg: Message = { role: "ai", content: "", timestamp: Date.now() };
+      const render = () => saveSessions(updatedWithUser.map(s =>
+        s.id === currentSessionId ? { ...s, messages: [...s.messages, { ...aiMsg }] } : s
+      ));
+
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // แต่ละ Event คั่นด้วยบรรทัดว่าง: "event: <name>\ndata: <json>"
+        const events = buffer.split("\n\n");
+        buffer = events.pop() || "";
+        for (const raw of events) {
+          const event = raw.match(/^event: (.*)$/m)?.[1];
+          const data = raw.match(/^data: (.*)$/m)?.[1];
+          if (!event || data === undefined) continue;
+          const payload = JSON.parse(data);
+
+          if (event === "sources") aiMsg.context = payload.length ? `Sources: ${payload.join(", ")}` : undefined;
+          else if (event === "token") aiMsg.content += payload;
+          else if (event === "error") throw new Error(payload);
+        }
+        setChatLoading(false);
+        render();
+      }
     } catch (error) {
        console.error(error);
        const errorMsg: Message = { role: "ai", content: "❌ Error connecting to AI. Please try again.", timestamp: Date.now() };